@@ -1,22 +1,68 @@
 import os
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-from flask import Flask, request, send_file
+from flask import Flask, Response, request, send_file
 import time
 import torch
 from generator import VoiceGenerator
+from openvoice.utils import CancellationToken
+from jobs import JobStore, JobWorkers, JOB_DONE
+from audio_cache import AudioCache
+from embeddings import (EmbeddingQueue, EmbeddingStore, EMBEDDING_PENDING, EMBEDDING_READY, EMBEDDING_FAILED,
+                        discard_embedding)
+import metrics
+from metrics import StageTimer, track_request
+import io
+import soundfile
 import concurrent.futures
 import tempfile
-from werkzeug.utils import secure_filename
-import glob
+import threading
+import hashlib
 from helpers import (
     UPLOAD_FOLDER, 
     ALLOWED_EXTENSIONS, 
     MINIMUM_AUDIO_LENGTH,
+    BATCH_MAX_SIZE,
+    BATCH_WINDOW_MS,
+    GENERATION_TIMEOUT,
+    BATCH_MAX_ITEMS,
+    BATCH_GENERATION_TIMEOUT,
+    JOBS_FOLDER,
+    JOB_WORKERS,
+    ENCODER_WORKERS,
+    OUTPUT_FORMATS,
+    AUDIO_CACHE_MEMORY_MB,
+    AUDIO_CACHE_DISK_MB,
+    AUDIO_CACHE_FOLDER,
+    SHAPE_BUCKETING,
+    EMBEDDING_STORE_FOLDER,
+    EMBEDDING_CACHE_SIZE,
+    TTS_LANGUAGES,
+    DEFAULT_LANGUAGE,
+    TTS_MEMORY_BUDGET_MB,
+    PIPELINE_QUEUE_SIZE,
+    TOKEN_BUCKETS,
+    FRAME_BUCKETS,
     allowed_file,
-    convert_to_mp3,
-    check_audio_length,
+    save_reference_voice,
+    list_reference_voice_files,
+    remove_reference_voice,
     get_cached_reference_speaker,
+    pending_reference_voices,
+    ready_reference_voices,
+    invalidate_foreign_embeddings,
+    describe_voice_file,
+    reference_voice_name,
+    reference_voice_version,
+    voice_catalog,
+    VOICE_PAGE_SIZE,
+    VOICE_PAGE_MAX,
+    resolve_output_format,
+    is_valid_seed,
+    encode_audio,
+    make_audio_archive,
+    float_to_pcm16,
+    wav_stream_header,
     make_response
 )
 
@@ -27,11 +73,203 @@ executor = concurrent.futures.ThreadPoolExecutor(
     max_workers=min(4, (os.cpu_count() or 1))
 )
 
+# Response compression runs here so inference threads never encode
+encoder_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=ENCODER_WORKERS,
+    thread_name_prefix="encoder"
+)
+
+# Repeated prompts for the same voice are served from here instead of re-synthesized
+audio_cache = AudioCache(
+    memory_budget=AUDIO_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_folder=AUDIO_CACHE_FOLDER,
+    disk_budget=AUDIO_CACHE_DISK_MB * 1024 * 1024
+)
+
 # Initialize generator once at startup
-generator = VoiceGenerator()
+generator = VoiceGenerator(
+    max_batch_size=BATCH_MAX_SIZE,
+    batch_window_ms=BATCH_WINDOW_MS,
+    audio_cache=audio_cache,
+    token_buckets=TOKEN_BUCKETS if SHAPE_BUCKETING else None,
+    frame_buckets=FRAME_BUCKETS if SHAPE_BUCKETING else None,
+    reference_version=reference_voice_version,
+    embedding_store_folder=EMBEDDING_STORE_FOLDER,
+    embedding_cache_size=EMBEDDING_CACHE_SIZE,
+    languages=TTS_LANGUAGES,
+    default_language=DEFAULT_LANGUAGE,
+    tts_memory_budget=TTS_MEMORY_BUDGET_MB * 1024 * 1024,
+    pipeline_queue_size=PIPELINE_QUEUE_SIZE
+)
+
+def run_generation_job(job):
+    """Job handler: generate the audio with no request timeout and store it next to the job database"""
+    params = job['params']
+    reference_speaker = get_cached_reference_speaker(params['reference_speaker'])
+    if reference_speaker is None:
+        raise RuntimeError(f"Reference voice '{params['reference_speaker']}' not found")
+    audio = generator.generate_speech(
+        params['text'],
+        reference_speaker,
+        params['speed'],
+        seed=params.get('seed'),
+        language=params.get('language')
+    )
+    if audio is None:
+        raise RuntimeError("Failed to process reference speaker")
+    
+    # Write under a temporary name so a crash never leaves a truncated file behind
+    audio_path = job_store.audio_path(job['id'])
+    temp_path = f"{audio_path}.part"
+    soundfile.write(temp_path, audio, generator.sampling_rate, format='WAV')
+    os.replace(temp_path, audio_path)
+    return audio_path
+
+# Long texts go through the persistent job queue instead of the request timeout
+job_store = JobStore(JOBS_FOLDER)
+job_workers = JobWorkers(job_store, run_generation_job, num_workers=JOB_WORKERS)
+
+# Index voice files stored before the catalog existed, and forget ones removed by hand
+added, removed = voice_catalog.sync(UPLOAD_FOLDER, describe_voice_file)
+if added or removed:
+    print(f"Voice catalog: indexed {added} new and dropped {removed} missing voice(s)")
+# Bulk-load the saved embeddings so every worker reads them from the shared store
+preloaded = generator.preload_embeddings(ready_reference_voices(generator.converter_version))
+if preloaded:
+    print(f"Embedding store: loaded {preloaded} voice embedding(s)")
+
+# Queue depths and cache counters are read at scrape time
+metrics.track_executor('generation', executor)
+metrics.track_executor('encoder', encoder_executor)
+metrics.track_cache('audio', audio_cache.info)
+if generator.conversion_batcher is not None:
+    metrics.track_queue('conversion', lambda: generator.conversion_batcher.depth)
+metrics.track_queue('embedding', lambda: embedding_queue.depth)
+metrics.track_cache('speaker_embedding', generator.source_se_cache.info)
+if generator.embedding_store is not None:
+    metrics.track_cache('embedding_store', generator.embedding_store.info)
+if generator.token_buckets is not None:
+    metrics.track_buckets('text_encoder', generator.token_buckets.info)
+    metrics.track_buckets('voice_conversion', generator.tone_color_converter.frame_buckets.info)
+
+def record_response_write(response, timer):
+    """Time from handing the response to the server until the body has been sent"""
+    start = time.perf_counter()
+    response.call_on_close(lambda: timer.record('response_write', time.perf_counter() - start))
+    return response
+
+def warm_up_in_background():
+    """Warm the models up off the request path; /ready reports when it is done"""
+    def run():
+        try:
+            generator.warm_up()
+        except Exception:
+            pass  # already logged and reported by /ready
+    threading.Thread(target=run, name="warm-up", daemon=True).start()
+
+def voice_not_found(reference_name):
+    return make_response(
+        status="error",
+        error=f"Reference voice '{reference_name}' not found",
+        http_code=404
+    )
+
+def unsupported_language(language):
+    """Error response for a 'language' this server does not serve, or None"""
+    if language is None or str(language).upper() in generator.tts_models.languages:
+        return None
+    return make_response(
+        status="error",
+        error=f"Unsupported language. Supported languages: {', '.join(generator.tts_models.languages)}",
+        http_code=400
+    )
+
+def invalid_seed(seed):
+    """Error response for a 'seed' that is not an integer, or None"""
+    if is_valid_seed(seed):
+        return None
+    return make_response(
+        status="error",
+        error="'seed' must be an integer",
+        http_code=400
+    )
+
+def resolve_reference(reference_name):
+    """
+    Look a voice up in the catalog for synchronous generation. Returns
+    (path, None), or (None, error response) for an unknown voice or one whose
+    embedding is still being extracted or failed to extract, since inline
+    extraction would outlast the timeout.
+    """
+    voice = voice_catalog.get(reference_name)
+    if voice is None:
+        return None, voice_not_found(reference_name)
+    if voice["embedding_status"] == EMBEDDING_PENDING:
+        response, code = make_response(
+            status="error",
+            error="Reference voice is still being processed, try again shortly",
+            http_code=409
+        )
+        response.headers['Retry-After'] = "5"
+        return None, (response, code)
+    if voice["embedding_status"] == EMBEDDING_FAILED:
+        return None, make_response(
+            status="error",
+            error=f"Reference voice could not be processed: {voice['embedding_error']}",
+            http_code=422
+        )
+    return get_cached_reference_speaker(reference_name), None
+
+def record_embedding(reference_speaker, audio_hash, se, error):
+    """EmbeddingQueue callback: store the outcome in the catalog, unless the voice was replaced meanwhile"""
+    name = reference_voice_name(reference_speaker)
+    if error is not None:
+        recorded = voice_catalog.set_embedding(name, EMBEDDING_FAILED, error=error, audio_hash=audio_hash)
+    else:
+        embedding_hash = hashlib.sha256(se.numpy().tobytes()).hexdigest()
+        recorded = voice_catalog.set_embedding(name, EMBEDDING_READY, embedding_hash=embedding_hash,
+                                               converter_version=generator.converter_version, audio_hash=audio_hash)
+    if not recorded:
+        # Also drop the files, so the replacement's extraction does not find them
+        print(f"Discarding embedding of replaced or deleted voice {name}")
+        discard_embedding(reference_speaker, audio_hash)
+    elif error is None and generator.embedding_store is not None and audio_hash is not None:
+        generator.embedding_store.put(EmbeddingStore.key(audio_hash, generator.converter_version), se.numpy())
+
+# Embeddings are extracted in the background at upload time, not on the first generation
+embedding_queue = EmbeddingQueue(generator.extract_embedding, on_result=record_embedding)
+
+def start_background_workers():
+    """Start the threads that serve this process; called in every worker after a fork"""
+    job_workers.start()
+    # Voices uploaded before a restart; lock files keep workers from extracting one twice
+    for reference_speaker in pending_reference_voices():
+        embedding_queue.submit(reference_speaker, reference_voice_version(reference_speaker))
+    # Pre-fork workers inherit a generator the parent already warmed up
+    if not generator.ready.is_set():
+        warm_up_in_background()
+
+def job_response_data(job):
+    """Public view of a job record"""
+    data = {
+        "job_id": job['id'],
+        "status": job['status'],
+        "created_at": job['created_at'],
+        "started_at": job['started_at'],
+        "finished_at": job['finished_at'],
+        "status_url": f"/jobs/{job['id']}"
+    }
+    if job['status'] == JOB_DONE:
+        data["audio_url"] = f"/jobs/{job['id']}/audio"
+    if job['error']:
+        data["error"] = job['error']
+    return data
 
 @app.route('/generate-audio', methods=['POST'])
+@track_request('generate-audio')
 def generate_speech_endpoint():
+    # Lets abandoned work stop at the next stage boundary instead of holding a worker
+    cancel_token = CancellationToken()
     try:
         start_time = time.time()
         
@@ -40,6 +278,9 @@ def generate_speech_endpoint():
         text = data.get('text')
         reference_name = data.get('reference_speaker')
         speed = float(data.get('speed', 1.0))
+        seed = data.get('seed')
+        language = data.get('language')
+        output_format = resolve_output_format(data.get('format'), request.accept_mimetypes)
         
         if not text or not reference_name:
             return make_response(
@@ -47,42 +288,90 @@ def generate_speech_endpoint():
                 error="'text' and 'reference_speaker' are required",
                 http_code=400
             )
+        
+        if output_format is None:
+            return make_response(
+                status="error",
+                error=f"Unsupported format. Supported formats: {', '.join(OUTPUT_FORMATS)}",
+                http_code=400
+            )
 
-        # Get cached reference speaker path
-        reference_speaker = get_cached_reference_speaker(reference_name)
+        error_response = invalid_seed(seed) or unsupported_language(language)
+        if error_response is not None:
+            return error_response
+
+        # Resolve the reference voice through the catalog
+        reference_speaker, error_response = resolve_reference(reference_name)
+        if error_response is not None:
+            return error_response
+        
+        # Started at submit time, so the wait for a free worker shows up as 'queued'
+        timer = StageTimer()
         
         # Submit task to thread pool
         future = executor.submit(
-            generator.generate_speech,
+            generator.generate_speech_cached,
             text, 
             reference_speaker,
-            speed
+            speed,
+            cancel_token,
+            seed,
+            timer,
+            language
         )
         
         # Set timeout to prevent hanging requests
-        output_path = future.result(timeout=10)
+        audio, cache_key, cache_hit = future.result(timeout=GENERATION_TIMEOUT)
+        if audio is None:
+            return make_response(
+                status="error",
+                error="Failed to process reference speaker",
+                http_code=500
+            )
+        
+        # Compress in memory on the encoder pool
+        with timer.stage('encode'):
+            body, mimetype = encoder_executor.submit(
+                encode_audio,
+                audio,
+                generator.sampling_rate,
+                output_format
+            ).result()
         
         generation_time = time.time() - start_time
         print(f"Total request processing time: {generation_time:.2f} seconds")
 
+        # Conditional send: the strong ETag hashes the bytes sent, not the request, since an
+        # unseeded request regenerated after eviction (or on another worker) sounds different
         response = send_file(
-            output_path,
-            mimetype='audio/wav',
+            io.BytesIO(body),
+            mimetype=mimetype,
             as_attachment=True,
-            download_name=f'generated_speech_{int(time.time())}.wav'
+            download_name=f'generated_speech_{int(time.time())}.{OUTPUT_FORMATS[output_format][1]}',
+            conditional=True,
+            etag=hashlib.sha256(body).hexdigest()
         )
+        response.headers['X-Cache'] = "HIT" if cache_hit else "MISS"
         
-        # Add generation time to response headers
+        # Add generation time and this request's stage breakdown to response headers
+        audio_duration = len(audio) / generator.sampling_rate
         response.headers['X-Generation-Time'] = f"{generation_time:.2f}"
-        return response
+        response.headers['X-Audio-Duration'] = f"{audio_duration:.2f}"
+        if audio_duration:
+            response.headers['X-Real-Time-Factor'] = f"{generation_time / audio_duration:.3f}"
+        response.headers['Server-Timing'] = timer.server_timing(audio_duration)
+        return record_response_write(response, timer)
 
     except concurrent.futures.TimeoutError:
+        cancel_token.cancel()
+        future.cancel()
         return make_response(
             status="error",
             error="Request timed out",
             http_code=504
         )
     except Exception as e:
+        cancel_token.cancel()
         print(f"Error in generate_speech: {e}")
         return make_response(
             status="error",
@@ -90,6 +379,278 @@ def generate_speech_endpoint():
             http_code=500
         )
 
+@app.route('/generate-audio/stream', methods=['POST'])
+@track_request('generate-audio/stream')
+def generate_speech_stream_endpoint():
+    """Stream generated speech sentence by sentence as chunked 16-bit PCM"""
+    cancel_token = CancellationToken()
+    try:
+        start_time = time.time()
+        
+        data = request.get_json()
+        text = data.get('text')
+        reference_name = data.get('reference_speaker')
+        speed = float(data.get('speed', 1.0))
+        stream_format = data.get('format', 'wav')
+        language = data.get('language')
+        
+        if not text or not reference_name:
+            return make_response(
+                status="error",
+                error="'text' and 'reference_speaker' are required",
+                http_code=400
+            )
+        
+        if stream_format not in ('wav', 'pcm'):
+            return make_response(
+                status="error",
+                error="'format' must be 'wav' or 'pcm'",
+                http_code=400
+            )
+
+        error_response = unsupported_language(language)
+        if error_response is not None:
+            return error_response
+
+        reference_speaker, error_response = resolve_reference(reference_name)
+        if error_response is not None:
+            return error_response
+        chunks = generator.generate_speech_stream(text, reference_speaker, speed, cancel_token, language)
+        
+        # Produce the first chunk before responding so early failures still get a proper status code
+        first_chunk = executor.submit(next, chunks, None).result(timeout=GENERATION_TIMEOUT)
+        print(f"Time to first audio chunk: {time.time() - start_time:.2f} seconds")
+        
+        def stream():
+            if stream_format == 'wav':
+                yield wav_stream_header(generator.sampling_rate)
+            chunk = first_chunk
+            try:
+                while chunk is not None:
+                    yield float_to_pcm16(chunk)
+                    chunk = executor.submit(next, chunks, None).result(timeout=GENERATION_TIMEOUT)
+            except Exception as e:
+                # Headers are already sent, so all we can do is end the stream
+                print(f"Error while streaming speech: {e}")
+            finally:
+                # Also reached when the client disconnects and the server closes this generator
+                cancel_token.cancel()
+            print(f"Total streaming time: {time.time() - start_time:.2f} seconds")
+        
+        if stream_format == 'wav':
+            mimetype = 'audio/wav'
+        else:
+            mimetype = f'audio/L16; rate={generator.sampling_rate}; channels=1'
+        
+        response = Response(stream(), mimetype=mimetype)
+        response.headers['X-Sample-Rate'] = str(generator.sampling_rate)
+        # No response_write here: sending a stream spans its whole generation
+        return response
+
+    except concurrent.futures.TimeoutError:
+        cancel_token.cancel()
+        return make_response(
+            status="error",
+            error="Request timed out",
+            http_code=504
+        )
+    except Exception as e:
+        cancel_token.cancel()
+        print(f"Error in generate_speech_stream: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+
+@app.route('/generate-audio/batch', methods=['POST'])
+@track_request('generate-audio/batch')
+def generate_speech_batch_endpoint():
+    """Generate speech for a list of items in one call and return a ZIP archive"""
+    cancel_token = CancellationToken()
+    try:
+        start_time = time.time()
+        
+        data = request.get_json()
+        raw_items = data.get('items') if isinstance(data, dict) else None
+        
+        if not raw_items or not isinstance(raw_items, list):
+            return make_response(
+                status="error",
+                error="'items' must be a non-empty list",
+                http_code=400
+            )
+        
+        if len(raw_items) > BATCH_MAX_ITEMS:
+            return make_response(
+                status="error",
+                error=f"At most {BATCH_MAX_ITEMS} items are allowed per batch",
+                http_code=400
+            )
+        
+        items = []
+        for index, raw_item in enumerate(raw_items):
+            if not isinstance(raw_item, dict) or not raw_item.get('text') or not raw_item.get('reference_speaker'):
+                return make_response(
+                    status="error",
+                    error=f"Item {index}: 'text' and 'reference_speaker' are required",
+                    http_code=400
+                )
+            items.append({
+                "text": raw_item['text'],
+                "reference_speaker": raw_item['reference_speaker'],
+                "speed": float(raw_item.get('speed', 1.0))
+            })
+        
+        for name in {item['reference_speaker'] for item in items}:
+            if voice_catalog.get(name) is None:
+                return voice_not_found(name)
+        
+        # The generator works on reference paths; the archive reports names
+        generator_items = [
+            dict(item, reference_speaker=get_cached_reference_speaker(item['reference_speaker']))
+            for item in items
+        ]
+        future = executor.submit(generator.generate_speech_batch, generator_items, cancel_token)
+        results = future.result(timeout=BATCH_GENERATION_TIMEOUT)
+        
+        generation_time = time.time() - start_time
+        print(f"Batch of {len(items)} items processed in {generation_time:.2f} seconds")
+        
+        timer = StageTimer()
+        with timer.stage('archive'):
+            archive = make_audio_archive(results, items, generator.sampling_rate)
+        response = send_file(
+            archive,
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=f'generated_speech_batch_{int(time.time())}.zip'
+        )
+        response.headers['X-Generation-Time'] = f"{generation_time:.2f}"
+        return record_response_write(response, timer)
+
+    except concurrent.futures.TimeoutError:
+        cancel_token.cancel()
+        future.cancel()
+        return make_response(
+            status="error",
+            error="Request timed out",
+            http_code=504
+        )
+    except Exception as e:
+        cancel_token.cancel()
+        print(f"Error in generate_speech_batch: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+
+@app.route('/jobs', methods=['POST'])
+@track_request('jobs')
+def submit_job():
+    """Queue a generation job and return its id without waiting for the audio"""
+    try:
+        data = request.get_json()
+        text = data.get('text')
+        reference_name = data.get('reference_speaker')
+        speed = float(data.get('speed', 1.0))
+        seed = data.get('seed')
+        language = data.get('language')
+        
+        if not text or not reference_name:
+            return make_response(
+                status="error",
+                error="'text' and 'reference_speaker' are required",
+                http_code=400
+            )
+        
+        error_response = invalid_seed(seed) or unsupported_language(language)
+        if error_response is not None:
+            return error_response
+        
+        if voice_catalog.get(reference_name) is None:
+            return voice_not_found(reference_name)
+        
+        job = job_store.create({
+            "text": text,
+            "reference_speaker": reference_name,
+            "speed": speed,
+            "seed": seed,
+            "language": language
+        })
+        job_workers.notify()
+        
+        return make_response(
+            status="ok",
+            data=job_response_data(job),
+            http_code=202
+        )
+
+    except Exception as e:
+        print(f"Error submitting job: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll the status of a generation job"""
+    try:
+        job = job_store.get(job_id)
+        if job is None:
+            return make_response(
+                status="error",
+                error="Job not found",
+                http_code=404
+            )
+        
+        return make_response(status="ok", data=job_response_data(job))
+
+    except Exception as e:
+        print(f"Error fetching job: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+
+@app.route('/jobs/<job_id>/audio', methods=['GET'])
+def get_job_audio(job_id):
+    """Download the audio of a finished generation job"""
+    try:
+        job = job_store.get(job_id)
+        if job is None:
+            return make_response(
+                status="error",
+                error="Job not found",
+                http_code=404
+            )
+        
+        if job['status'] != JOB_DONE:
+            return make_response(
+                status="error",
+                error=f"Job is {job['status']}",
+                http_code=409
+            )
+        
+        return send_file(
+            job['audio_path'],
+            mimetype='audio/wav',
+            as_attachment=True,
+            download_name=f'generated_speech_{job_id}.wav'
+        )
+
+    except Exception as e:
+        print(f"Error downloading job audio: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+
 @app.route('/reference-voices', methods=['POST'])
 def upload_reference_voice():
     """Upload a new reference voice file and convert to MP3"""
@@ -129,35 +690,30 @@ def upload_reference_voice():
         with tempfile.NamedTemporaryFile(delete=False) as temp_file:
             file.save(temp_file.name)
             
-            # Check audio length
-            if not check_audio_length(temp_file.name):
-                # Clean up temp file
-                os.unlink(temp_file.name)
+            # Decode once: check the length, store the MP3 and the PCM copy
+            filename = save_reference_voice(temp_file.name, name, generator.sampling_rate)
+            
+            # Clean up the temporary file
+            os.unlink(temp_file.name)
+            
+            if filename is None:
                 return make_response(
                     status="error",
                     error=f"Audio file must be at least {MINIMUM_AUDIO_LENGTH} seconds long",
                     http_code=400
                 )
-            
-            # Define the final MP3 filename and path
-            filename = secure_filename(f"{name}.mp3")
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            
-            # Convert to MP3 format
-            convert_to_mp3(temp_file.name, filepath)
-            
-            # Clean up the temporary file
-            os.unlink(temp_file.name)
 
-        # Clear the cache for this reference name
-        if get_cached_reference_speaker.cache_info():
-            get_cached_reference_speaker.cache_clear()
+        # Extract the tone color embedding now, in the background
+        reference_speaker = os.path.join(UPLOAD_FOLDER, filename)
+        generator.forget_reference(reference_speaker)
+        embedding_queue.submit(reference_speaker, reference_voice_version(reference_speaker))
 
         return make_response(
             status="ok",
             data={
                 "message": "Reference voice uploaded and converted to MP3 successfully",
-                "filename": filename
+                "filename": filename,
+                "embedding": EMBEDDING_PENDING
             }
         )
 
@@ -178,23 +734,17 @@ def upload_reference_voice():
 
 @app.route('/reference-voices', methods=['GET'])
 def list_reference_voices():
-    """List all available reference voices"""
+    """List reference voices from the catalog, one page at a time"""
     try:
-        voices = []
-        pattern = os.path.join(UPLOAD_FOLDER, "*.mp3")
-        for filepath in glob.glob(pattern):
-            filename = os.path.basename(filepath)
-            name = filename.rsplit('.', 1)[0]
-            voices.append({
-                "name": name,
-                "filename": filename,
-                "format": "mp3"
-            })
+        limit = min(max(request.args.get('limit', VOICE_PAGE_SIZE, type=int), 1), VOICE_PAGE_MAX)
+        voices = list_reference_voice_files(limit=limit, after=request.args.get('after'))
 
         return make_response(
             status="ok",
             data={
-                "voices": voices
+                "voices": voices,
+                # Pass as ?after= to get the next page; None on the last one
+                "next": voices[-1]["name"] if len(voices) == limit else None
             }
         )
 
@@ -210,8 +760,8 @@ def list_reference_voices():
 def download_reference_voice(name):
     """Download a specific reference voice file"""
     try:
-        filepath = os.path.join(UPLOAD_FOLDER, f"{name}.mp3")
-        if os.path.exists(filepath):
+        filepath = get_cached_reference_speaker(name)
+        if filepath is not None and os.path.exists(filepath):
             return send_file(
                 filepath,
                 mimetype='audio/mpeg',
@@ -237,23 +787,14 @@ def download_reference_voice(name):
 def delete_reference_voice(name):
     """Delete a specific reference voice file"""
     try:
-        deleted = False
-        for ext in ALLOWED_EXTENSIONS:
-            filepath = os.path.join(UPLOAD_FOLDER, f"{name}.{ext}")
-            if os.path.exists(filepath):
-                os.remove(filepath)
-                deleted = True
-                # Clear the cache for this reference name
-                if get_cached_reference_speaker.cache_info():
-                    get_cached_reference_speaker.cache_clear()
-                break
-
-        if not deleted:
+        reference_speaker = get_cached_reference_speaker(name)
+        if not remove_reference_voice(name):
             return make_response(
                 status="error",
                 error="Reference voice not found",
                 http_code=404
             )
+        generator.forget_reference(reference_speaker)
 
         return make_response(
             status="ok",
@@ -283,6 +824,19 @@ def health():
             http_code=500
         )
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: succeeds only once the startup warm-up has finished"""
+    data = {"warm_up": generator.warm_up_timings}
+    if generator.ready.is_set():
+        return make_response(status="ok", data=data)
+    return make_response(
+        status="error",
+        data=data,
+        error=f"Warm-up failed: {generator.warm_up_error}" if generator.warm_up_error else "Warming up",
+        http_code=503
+    )
+
 @app.route('/system-info', methods=['GET'])
 def system_info():
     """Endpoint to check system configuration including GPU status"""
@@ -300,7 +854,19 @@ def system_info():
         }
         return make_response(
             status="ok",
-            data={"system_info": device_info}
+            data={
+                "system_info": device_info,
+                "audio_cache": audio_cache.info(),
+                "shape_buckets": generator.bucket_info(),
+                "embedding_cache": generator.source_se_cache.info(),
+                "tts_models": generator.tts_models.info(),
+                "pipeline": generator.pipeline_stats.info(),
+                "coalesced": {
+                    "speech": generator.speech_flights.info(),
+                    "embedding": generator.embedding_flights.info()
+                },
+                "embedding_store": generator.embedding_store.info() if generator.embedding_store else None
+            }
         )
     except Exception as e:
         print(f"System info check failed: {e}")
@@ -310,6 +876,12 @@ def system_info():
             http_code=500
         )
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 @app.route('/', methods=['GET'])
 def index():
     """Simple landing page with API documentation"""
@@ -323,13 +895,61 @@ def index():
                 "parameters": {
                     "text": "Text to convert to speech",
                     "reference_speaker": "Name of the reference voice to use",
-                    "speed": "(optional) Speech speed multiplier (default: 1.0)"
+                    "speed": "(optional) Speech speed multiplier (default: 1.0)",
+                    "format": "(optional) wav, pcm16, flac, ogg (Opus) or mp3; falls back to the Accept header, then wav",
+                    "language": "(optional) Base TTS language, e.g. EN or ZH; detected from the text's script by default",
+                    "seed": "(optional) Integer seed for reproducible output"
+                },
+                "response_headers": {
+                    "Server-Timing": "Milliseconds spent queued and in each stage (frontend, tts, conversion, watermark, encode), plus audio duration and real-time factor",
+                    "X-Audio-Duration": "Seconds of generated audio",
+                    "X-Real-Time-Factor": "Processing time divided by audio duration"
+                }
+            },
+            "/generate-audio/stream": {
+                "method": "POST",
+                "content_type": "application/json",
+                "description": "Stream generated speech sentence by sentence (chunked 16-bit PCM)",
+                "parameters": {
+                    "text": "Text to convert to speech",
+                    "reference_speaker": "Name of the reference voice to use",
+                    "speed": "(optional) Speech speed multiplier (default: 1.0)",
+                    "format": "(optional) 'wav' for a WAV header followed by frames, or 'pcm' for raw frames (default: wav)",
+                    "language": "(optional) Base TTS language; detected from the text's script by default"
+                }
+            },
+            "/generate-audio/batch": {
+                "method": "POST",
+                "content_type": "application/json",
+                "description": "Generate speech for many texts in one call; returns a ZIP of WAVs plus manifest.json",
+                "parameters": {
+                    "items": "List of {text, reference_speaker, speed} objects"
                 }
             },
+            "/jobs": {
+                "method": "POST",
+                "content_type": "application/json",
+                "description": "Queue a generation job (no request timeout); returns a job id",
+                "parameters": {
+                    "text": "Text to convert to speech",
+                    "reference_speaker": "Name of the reference voice to use",
+                    "speed": "(optional) Speech speed multiplier (default: 1.0)",
+                    "language": "(optional) Base TTS language, e.g. EN or ZH; detected from the text's script by default",
+                    "seed": "(optional) Integer seed for reproducible output"
+                }
+            },
+            "/jobs/<job_id>": {
+                "method": "GET",
+                "description": "Job status: queued, running, done or failed"
+            },
+            "/jobs/<job_id>/audio": {
+                "method": "GET",
+                "description": "Download the audio of a finished job"
+            },
             "/reference-voices": {
                 "method": "POST",
                 "content_type": "multipart/form-data",
-                "description": "Upload a new reference voice",
+                "description": "Upload a new reference voice; its embedding is extracted in the background",
                 "parameters": {
                     "file": "Audio file (mp3 or wav)",
                     "name": "Name for the reference voice"
@@ -337,7 +957,11 @@ def index():
             },
             "/reference-voices": {
                 "method": "GET",
-                "description": "List all available reference voices"
+                "description": "List reference voices with their metadata and embedding status (pending, ready or failed)",
+                "parameters": {
+                    "limit": f"(optional) Page size, at most {VOICE_PAGE_MAX} (default: {VOICE_PAGE_SIZE})",
+                    "after": "(optional) The 'next' cursor of the previous page"
+                }
             },
             "/reference-voices/<name>": {
                 "method": "GET",
@@ -351,14 +975,30 @@ def index():
                 "method": "GET",
                 "description": "Health check endpoint"
             },
+            "/ready": {
+                "method": "GET",
+                "description": "Readiness check: 503 until the startup warm-up has finished, then 200 with per-step warm-up times"
+            },
             "/system-info": {
                 "method": "GET",
                 "description": "System configuration and GPU status"
+            },
+            "/metrics": {
+                "method": "GET",
+                "description": "Prometheus metrics: per-stage latency histograms, request counts, queue depths and cache hit rates"
             }
         }
     }
     return make_response(status="ok", data=api_docs)
 
 if __name__ == '__main__':
-    # Use Gunicorn for production
+    # Use Gunicorn for production (see gunicorn.conf.py for the pre-fork worker mode)
+    # Jobs a previous run left running; under gunicorn its on_starting hook does this once
+    requeued = job_store.requeue_running()
+    if requeued:
+        print(f"Requeued {requeued} unfinished job(s)")
+    invalidated = invalidate_foreign_embeddings(generator.converter_version)
+    if invalidated:
+        print(f"Re-extracting {invalidated} embedding(s) of another converter checkpoint")
+    start_background_workers()
     app.run(host='0.0.0.0', port=8585, debug=False)
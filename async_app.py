@@ -0,0 +1,649 @@
+import os
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import time
+import asyncio
+import hashlib
+import tempfile
+import concurrent.futures
+import torch
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, FileResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, parse_range_header, quote_etag
+from generator import VoiceGenerator
+from openvoice.utils import CancellationToken
+from embeddings import (EmbeddingQueue, EmbeddingStore, EMBEDDING_PENDING, EMBEDDING_READY, EMBEDDING_FAILED,
+                        discard_embedding)
+import metrics
+from metrics import StageTimer, track_request
+from helpers import (
+    UPLOAD_FOLDER,
+    ALLOWED_EXTENSIONS,
+    MINIMUM_AUDIO_LENGTH,
+    BATCH_MAX_SIZE,
+    BATCH_WINDOW_MS,
+    INFERENCE_QUEUE_SIZE,
+    MODEL_WORKERS,
+    GENERATION_TIMEOUT,
+    ENCODER_WORKERS,
+    OUTPUT_FORMATS,
+    SHAPE_BUCKETING,
+    EMBEDDING_STORE_FOLDER,
+    EMBEDDING_CACHE_SIZE,
+    TTS_LANGUAGES,
+    DEFAULT_LANGUAGE,
+    TTS_MEMORY_BUDGET_MB,
+    PIPELINE_QUEUE_SIZE,
+    TOKEN_BUCKETS,
+    FRAME_BUCKETS,
+    allowed_file,
+    save_reference_voice,
+    list_reference_voice_files,
+    remove_reference_voice,
+    get_cached_reference_speaker,
+    pending_reference_voices,
+    ready_reference_voices,
+    invalidate_foreign_embeddings,
+    describe_voice_file,
+    reference_voice_name,
+    reference_voice_version,
+    voice_catalog,
+    VOICE_PAGE_SIZE,
+    VOICE_PAGE_MAX,
+    resolve_output_format,
+    is_valid_seed,
+    encode_audio,
+    response_body
+)
+
+
+class QueueFullError(Exception):
+    """Raised when the inference queue cannot take more work"""
+
+
+class InferenceQueue:
+    """
+    Bounded queue of inference jobs drained by a fixed set of model workers.
+
+    Each worker pulls one job at a time and runs it on a dedicated thread, so
+    at most ``num_workers`` generations run at once and at most ``max_size``
+    wait behind them. Anything beyond that is rejected immediately.
+    """
+
+    def __init__(self, max_size, num_workers):
+        self.max_size = max_size
+        self.num_workers = num_workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=num_workers,
+            thread_name_prefix="model-worker"
+        )
+        self.queue = None
+        self.in_flight = 0
+        self._workers = []
+
+    @property
+    def depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self.executor.shutdown(wait=False)
+
+    def submit(self, fn, *args):
+        """Queue ``fn(*args)`` and return a future for its result, or raise QueueFullError"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((fn, args, future))
+        except asyncio.QueueFull:
+            raise QueueFullError()
+        return future
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            fn, args, future = await self.queue.get()
+            try:
+                # Skip jobs whose caller already gave up while they were queued
+                if future.done():
+                    continue
+                self.in_flight += 1
+                try:
+                    result = await loop.run_in_executor(self.executor, fn, *args)
+                    if not future.done():
+                        future.set_result(result)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                finally:
+                    self.in_flight -= 1
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        return {
+            "queue_depth": self.depth,
+            "queue_capacity": self.max_size,
+            "in_flight": self.in_flight,
+            "workers": self.num_workers
+        }
+
+
+# Initialize generator once at startup
+generator = VoiceGenerator(
+    max_batch_size=BATCH_MAX_SIZE,
+    batch_window_ms=BATCH_WINDOW_MS,
+    token_buckets=TOKEN_BUCKETS if SHAPE_BUCKETING else None,
+    frame_buckets=FRAME_BUCKETS if SHAPE_BUCKETING else None,
+    reference_version=reference_voice_version,
+    embedding_store_folder=EMBEDDING_STORE_FOLDER,
+    embedding_cache_size=EMBEDDING_CACHE_SIZE,
+    languages=TTS_LANGUAGES,
+    default_language=DEFAULT_LANGUAGE,
+    tts_memory_budget=TTS_MEMORY_BUDGET_MB * 1024 * 1024,
+    pipeline_queue_size=PIPELINE_QUEUE_SIZE
+)
+inference_queue = InferenceQueue(INFERENCE_QUEUE_SIZE, MODEL_WORKERS)
+encoder_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=ENCODER_WORKERS,
+    thread_name_prefix="encoder"
+)
+metrics.track_queue('inference', lambda: inference_queue.depth)
+metrics.track_queue('embedding', lambda: embedding_queue.depth)
+metrics.track_cache('speaker_embedding', generator.source_se_cache.info)
+if generator.embedding_store is not None:
+    metrics.track_cache('embedding_store', generator.embedding_store.info)
+metrics.track_executor('encoder', encoder_executor)
+if generator.conversion_batcher is not None:
+    metrics.track_queue('conversion', lambda: generator.conversion_batcher.depth)
+if generator.token_buckets is not None:
+    metrics.track_buckets('text_encoder', generator.token_buckets.info)
+    metrics.track_buckets('voice_conversion', generator.tone_color_converter.frame_buckets.info)
+
+
+def make_response(status="ok", data=None, error=None, http_code=200, headers=None):
+    """Create a standardized JSON response"""
+    return JSONResponse(response_body(status, data, error), status_code=http_code, headers=headers)
+
+
+def unsupported_language(language):
+    """Error response for a 'language' this server does not serve, or None"""
+    if language is None or str(language).upper() in generator.tts_models.languages:
+        return None
+    return make_response(
+        status="error",
+        error=f"Unsupported language. Supported languages: {', '.join(generator.tts_models.languages)}",
+        http_code=400
+    )
+
+def invalid_seed(seed):
+    """Error response for a 'seed' that is not an integer, or None"""
+    if is_valid_seed(seed):
+        return None
+    return make_response(
+        status="error",
+        error="'seed' must be an integer",
+        http_code=400
+    )
+
+
+def conditional_response(request, body, media_type, headers):
+    """
+    ``body`` answered like Flask's send_file(conditional=True): a strong ETag
+    hashing the bytes, 304 for a matching If-None-Match, and a single byte
+    range for Range (unless If-Range names other bytes).
+    """
+    etag = quote_etag(hashlib.sha256(body).hexdigest())
+    headers = dict(headers, ETag=etag, **{"Accept-Ranges": "bytes"})
+    if parse_etags(request.headers.get('if-none-match')).contains_weak(etag.strip('"')):
+        return Response(status_code=304, headers=headers)
+    byte_range = parse_range_header(request.headers.get('range'))
+    if_range = request.headers.get('if-range')
+    if byte_range is None or (if_range is not None and if_range != etag):
+        return Response(body, media_type=media_type, headers=headers)
+    span = byte_range.range_for_length(len(body))
+    if span is None:
+        return Response(status_code=416, headers=dict(headers, **{"Content-Range": f"bytes */{len(body)}"}))
+    start, stop = span
+    headers["Content-Range"] = byte_range.to_content_range_header(len(body))
+    return Response(body[start:stop], status_code=206, media_type=media_type, headers=headers)
+
+
+def resolve_reference(reference_name):
+    """
+    Look a voice up in the catalog. Returns (path, None), or (None, error
+    response) for an unknown voice or one whose embedding is pending or failed.
+    """
+    voice = voice_catalog.get(reference_name)
+    if voice is None:
+        return None, make_response(
+            status="error",
+            error=f"Reference voice '{reference_name}' not found",
+            http_code=404
+        )
+    if voice["embedding_status"] == EMBEDDING_PENDING:
+        return None, make_response(
+            status="error",
+            error="Reference voice is still being processed, try again shortly",
+            http_code=409,
+            headers={"Retry-After": "5"}
+        )
+    if voice["embedding_status"] == EMBEDDING_FAILED:
+        return None, make_response(
+            status="error",
+            error=f"Reference voice could not be processed: {voice['embedding_error']}",
+            http_code=422
+        )
+    return get_cached_reference_speaker(reference_name), None
+
+
+def record_embedding(reference_speaker, audio_hash, se, error):
+    """EmbeddingQueue callback: store the outcome in the catalog, unless the voice was replaced meanwhile"""
+    name = reference_voice_name(reference_speaker)
+    if error is not None:
+        recorded = voice_catalog.set_embedding(name, EMBEDDING_FAILED, error=error, audio_hash=audio_hash)
+    else:
+        embedding_hash = hashlib.sha256(se.numpy().tobytes()).hexdigest()
+        recorded = voice_catalog.set_embedding(name, EMBEDDING_READY, embedding_hash=embedding_hash,
+                                               converter_version=generator.converter_version, audio_hash=audio_hash)
+    if not recorded:
+        # Also drop the files, so the replacement's extraction does not find them
+        print(f"Discarding embedding of replaced or deleted voice {name}")
+        discard_embedding(reference_speaker, audio_hash)
+    elif error is None and generator.embedding_store is not None and audio_hash is not None:
+        generator.embedding_store.put(EmbeddingStore.key(audio_hash, generator.converter_version), se.numpy())
+
+
+# Embeddings are extracted in the background at upload time, not on the first generation
+embedding_queue = EmbeddingQueue(generator.extract_embedding, on_result=record_embedding)
+
+
+async def wait_for_generation(request, future, cancel_token, poll_interval=0.25):
+    """
+    Wait for a queued generation, cancelling it on timeout or client disconnect.
+    Returns None if the client disconnected; raises asyncio.TimeoutError on timeout.
+    """
+    deadline = time.monotonic() + GENERATION_TIMEOUT
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            done, _ = await asyncio.wait({future}, timeout=min(poll_interval, remaining))
+            if done:
+                return future.result()
+            if await request.is_disconnected():
+                print("Client disconnected, cancelling generation")
+                cancel_token.cancel()
+                return None
+    except BaseException:
+        # Timeout or server-side cancellation: stop the work wherever it is
+        cancel_token.cancel()
+        future.cancel()
+        raise
+
+
+@track_request('generate-audio')
+async def generate_speech_endpoint(request):
+    cancel_token = CancellationToken()
+    try:
+        start_time = time.time()
+
+        data = await request.json()
+        text = data.get('text')
+        reference_name = data.get('reference_speaker')
+        speed = float(data.get('speed', 1.0))
+        seed = data.get('seed')
+        language = data.get('language')
+        output_format = resolve_output_format(data.get('format'), parse_accept_header(request.headers.get('accept'), MIMEAccept))
+
+        if not text or not reference_name:
+            return make_response(
+                status="error",
+                error="'text' and 'reference_speaker' are required",
+                http_code=400
+            )
+
+        if output_format is None:
+            return make_response(
+                status="error",
+                error=f"Unsupported format. Supported formats: {', '.join(OUTPUT_FORMATS)}",
+                http_code=400
+            )
+
+        error_response = invalid_seed(seed)
+        if error_response is not None:
+            return error_response
+
+        error_response = unsupported_language(language)
+        if error_response is not None:
+            return error_response
+
+        reference_speaker, error_response = resolve_reference(reference_name)
+        if error_response is not None:
+            return error_response
+
+        # Started at submit time, so the wait for a model worker shows up as 'queued'
+        timer = StageTimer()
+        try:
+            future = inference_queue.submit(
+                generator.generate_speech_cached, text, reference_speaker, speed, cancel_token, seed, timer, language
+            )
+        except QueueFullError:
+            return make_response(
+                status="error",
+                error="Server is busy, try again later",
+                http_code=429,
+                headers={"Retry-After": "1", "X-Queue-Depth": str(inference_queue.depth)}
+            )
+
+        result = await wait_for_generation(request, future, cancel_token)
+        if result is None:
+            # Client went away; nobody is left to read a response
+            return Response(status_code=499)
+        audio, _, cache_hit = result
+        if audio is None:
+            return make_response(
+                status="error",
+                error="Failed to process reference speaker",
+                http_code=500
+            )
+
+        # Compress on the encoder pool, never on a model worker
+        with timer.stage('encode'):
+            body, mimetype = await asyncio.get_running_loop().run_in_executor(
+                encoder_executor, encode_audio, audio, generator.sampling_rate, output_format
+            )
+        generation_time = time.time() - start_time
+        print(f"Total request processing time: {generation_time:.2f} seconds")
+
+        extension = OUTPUT_FORMATS[output_format][1]
+        audio_duration = len(audio) / generator.sampling_rate
+        headers = {
+            "Content-Disposition": f'attachment; filename="generated_speech_{int(time.time())}.{extension}"',
+            "X-Generation-Time": f"{generation_time:.2f}",
+            "X-Audio-Duration": f"{audio_duration:.2f}",
+            "X-Queue-Depth": str(inference_queue.depth),
+            "X-Cache": "HIT" if cache_hit else "MISS",
+            "Server-Timing": timer.server_timing(audio_duration)
+        }
+        if audio_duration:
+            headers["X-Real-Time-Factor"] = f"{generation_time / audio_duration:.3f}"
+        return conditional_response(request, body, mimetype, headers)
+
+    except asyncio.TimeoutError:
+        return make_response(
+            status="error",
+            error="Request timed out",
+            http_code=504
+        )
+    except Exception as e:
+        print(f"Error in generate_speech: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+
+
+async def upload_reference_voice(request):
+    """Upload a new reference voice file and convert to MP3"""
+    temp_path = None
+    try:
+        form = await request.form()
+        file = form.get('file')
+        name = form.get('name')
+
+        if file is None or isinstance(file, str):
+            return make_response(
+                status="error",
+                error="No file provided",
+                http_code=400
+            )
+
+        if not name:
+            return make_response(
+                status="error",
+                error="Name is required",
+                http_code=400
+            )
+
+        if not file.filename:
+            return make_response(
+                status="error",
+                error="No selected file",
+                http_code=400
+            )
+
+        if not allowed_file(file.filename):
+            return make_response(
+                status="error",
+                error=f"File type not allowed. Supported types: {', '.join(ALLOWED_EXTENSIONS)}",
+                http_code=400
+            )
+
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+            temp_path = temp_file.name
+            temp_file.write(await file.read())
+
+        # Decoding and MP3 encoding block, so keep them off the event loop
+        filename = await asyncio.get_running_loop().run_in_executor(
+            None, save_reference_voice, temp_path, name, generator.sampling_rate
+        )
+        if filename is None:
+            return make_response(
+                status="error",
+                error=f"Audio file must be at least {MINIMUM_AUDIO_LENGTH} seconds long",
+                http_code=400
+            )
+
+        # Extract the tone color embedding now, in the background
+        reference_speaker = os.path.join(UPLOAD_FOLDER, filename)
+        generator.forget_reference(reference_speaker)
+        embedding_queue.submit(reference_speaker, reference_voice_version(reference_speaker))
+
+        return make_response(
+            status="ok",
+            data={
+                "message": "Reference voice uploaded and converted to MP3 successfully",
+                "filename": filename,
+                "embedding": EMBEDDING_PENDING
+            }
+        )
+
+    except Exception as e:
+        print(f"Error uploading reference voice: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+    finally:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+async def list_reference_voices(request):
+    """List reference voices from the catalog, one page at a time"""
+    try:
+        # Like Flask's type=int: a limit that is not an integer falls back to the default
+        try:
+            limit = int(request.query_params.get('limit', VOICE_PAGE_SIZE))
+        except ValueError:
+            limit = VOICE_PAGE_SIZE
+        limit = min(max(limit, 1), VOICE_PAGE_MAX)
+        voices = list_reference_voice_files(limit=limit, after=request.query_params.get('after'))
+        return make_response(
+            status="ok",
+            data={
+                "voices": voices,
+                "next": voices[-1]["name"] if len(voices) == limit else None
+            }
+        )
+    except Exception as e:
+        print(f"Error listing reference voices: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+
+
+async def download_reference_voice(request):
+    """Download a specific reference voice file"""
+    try:
+        filepath = get_cached_reference_speaker(request.path_params['name'])
+        if filepath is not None and os.path.exists(filepath):
+            return FileResponse(
+                filepath,
+                media_type='audio/mpeg',
+                filename=os.path.basename(filepath)
+            )
+
+        return make_response(
+            status="error",
+            error="Reference voice not found",
+            http_code=404
+        )
+    except Exception as e:
+        print(f"Error downloading reference voice: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+
+
+async def delete_reference_voice(request):
+    """Delete a specific reference voice file"""
+    try:
+        reference_speaker = get_cached_reference_speaker(request.path_params['name'])
+        if not remove_reference_voice(request.path_params['name']):
+            return make_response(
+                status="error",
+                error="Reference voice not found",
+                http_code=404
+            )
+        generator.forget_reference(reference_speaker)
+
+        return make_response(
+            status="ok",
+            data={
+                "message": "Reference voice deleted successfully"
+            }
+        )
+    except Exception as e:
+        print(f"Error deleting reference voice: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+
+
+async def health(request):
+    """Health check endpoint, including inference queue depth"""
+    return make_response(status="ok", data={"queue": inference_queue.stats()})
+
+
+async def metrics_endpoint(request):
+    """Prometheus scrape endpoint"""
+    body, content_type = metrics.render()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+async def ready(request):
+    """Readiness probe: succeeds only once the startup warm-up has finished"""
+    data = {"warm_up": generator.warm_up_timings}
+    if generator.ready.is_set():
+        return make_response(status="ok", data=data)
+    return make_response(
+        status="error",
+        data=data,
+        error=f"Warm-up failed: {generator.warm_up_error}" if generator.warm_up_error else "Warming up",
+        http_code=503
+    )
+
+
+def start_warm_up():
+    """Warm the models up on a model worker thread while the server already answers probes"""
+    async def run():
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, generator.warm_up)
+        except Exception:
+            pass  # already logged and reported by /ready
+    asyncio.get_running_loop().create_task(run())
+
+
+def start_embedding_extraction():
+    """Reconcile the voice catalog with the voice folder, then queue voices whose embedding is missing"""
+    added, removed = voice_catalog.sync(UPLOAD_FOLDER, describe_voice_file)
+    if added or removed:
+        print(f"Voice catalog: indexed {added} new and dropped {removed} missing voice(s)")
+    # Single process, so this startup step runs here once
+    invalidated = invalidate_foreign_embeddings(generator.converter_version)
+    if invalidated:
+        print(f"Re-extracting {invalidated} embedding(s) of another converter checkpoint")
+    preloaded = generator.preload_embeddings(ready_reference_voices(generator.converter_version))
+    if preloaded:
+        print(f"Embedding store: loaded {preloaded} voice embedding(s)")
+    for reference_speaker in pending_reference_voices():
+        embedding_queue.submit(reference_speaker, reference_voice_version(reference_speaker))
+
+
+async def system_info(request):
+    """Endpoint to check system configuration including GPU status"""
+    try:
+        device_info = {
+            "device": generator.device,
+            "cuda_available": torch.cuda.is_available()
+        }
+        return make_response(
+            status="ok",
+            data={
+                "system_info": device_info,
+                "queue": inference_queue.stats(),
+                "embedding_cache": generator.source_se_cache.info(),
+                "tts_models": generator.tts_models.info(),
+                "pipeline": generator.pipeline_stats.info(),
+                "coalesced": {
+                    "speech": generator.speech_flights.info(),
+                    "embedding": generator.embedding_flights.info()
+                }
+            }
+        )
+    except Exception as e:
+        print(f"System info check failed: {e}")
+        return make_response(
+            status="error",
+            error=str(e),
+            http_code=500
+        )
+
+
+app = Starlette(
+    routes=[
+        Route('/generate-audio', generate_speech_endpoint, methods=['POST']),
+        Route('/reference-voices', upload_reference_voice, methods=['POST']),
+        Route('/reference-voices', list_reference_voices, methods=['GET']),
+        Route('/reference-voices/{name}', download_reference_voice, methods=['GET']),
+        Route('/reference-voices/{name}', delete_reference_voice, methods=['DELETE']),
+        Route('/health', health, methods=['GET']),
+        Route('/ready', ready, methods=['GET']),
+        Route('/system-info', system_info, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+    ],
+    on_startup=[inference_queue.start, start_warm_up, start_embedding_extraction],
+    on_shutdown=[inference_queue.stop]
+)
+
+if __name__ == '__main__':
+    # Single process: the event loop owns all connections, model workers own inference
+    uvicorn.run(app, host='0.0.0.0', port=8585)
@@ -0,0 +1,141 @@
+import os
+import fcntl
+import threading
+from collections import OrderedDict
+
+
+class AudioCache:
+    """
+    Two-tier, content-addressed cache of synthesized audio.
+
+    Keys are hex digests computed by the caller; values are raw bytes. The
+    memory tier and the disk tier are each kept under their own byte budget
+    by evicting the least recently used entries. Disk hits are promoted to
+    memory, and disk recency survives restarts through file mtimes.
+
+    The disk folder may be shared by several processes (e.g. pre-fork
+    workers): lookups go to the files themselves, so entries written by
+    siblings are hits, and the budget is enforced on the folder's real
+    contents under an exclusive flock.
+    """
+
+    def __init__(self, memory_budget, disk_folder=None, disk_budget=0):
+        self.memory_budget = memory_budget
+        self.disk_folder = disk_folder
+        self.disk_budget = disk_budget if disk_folder else 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._disk_entries = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        if self.disk_budget:
+            os.makedirs(disk_folder, exist_ok=True)
+            self._lock_path = os.path.join(disk_folder, '.lock')
+            self._evict_disk()
+
+    def _path(self, key):
+        return os.path.join(self.disk_folder, key[:2], f"{key}.bin")
+
+    def _scan_disk(self):
+        # (mtime, path, size) of every entry in the folder, least recently used first
+        entries = []
+        for root, _, files in os.walk(self.disk_folder):
+            for filename in files:
+                if not filename.endswith('.bin'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # evicted by another process meanwhile
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return sorted(entries)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+
+        if self.disk_budget:
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    value = f.read()
+                os.utime(path)
+            except FileNotFoundError:
+                pass  # never stored, or evicted by any process sharing the folder
+            else:
+                with self._lock:
+                    self.stats["disk_hits"] += 1
+                    self._put_memory(key, value)
+                return value
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._put_memory(key, value)
+        if not self.disk_budget or len(value) > self.disk_budget:
+            return
+
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(temp_path, 'wb') as f:
+            f.write(value)
+        os.replace(temp_path, path)
+        self._evict_disk()
+
+    def _put_memory(self, key, value):
+        if len(value) > self.memory_budget:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self):
+        # One process at a time, measured from the folder so every writer's files count
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = self._scan_disk()
+            total = sum(size for _, _, size in entries)
+            evicted = 0
+            for _, path, size in entries:
+                if total <= self.disk_budget:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self._disk_entries = len(entries) - evicted
+            self.stats["evictions"] += evicted
+
+    def info(self):
+        with self._lock:
+            lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                hit_rate=(lookups - self.stats["misses"]) / lookups if lookups else 0.0,
+                memory_bytes=self._memory_bytes,
+                memory_entries=len(self._memory),
+                # As of this process's last write
+                disk_bytes=self._disk_bytes,
+                disk_entries=self._disk_entries
+            )
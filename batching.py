@@ -0,0 +1,100 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from metrics import CONVERSION_BATCH_SIZE, StageTimer
+
+
+class ConversionBatcher:
+    """
+    Dynamic micro-batching in front of ToneColorConverter.
+
+    Requests are collected for up to ``max_wait_ms`` after the first one
+    arrives, or until ``max_batch_size`` are waiting, and then converted in a
+    single batched pass. Each caller gets a Future for its own audio.
+    """
+
+    def __init__(self, converter, max_batch_size=8, max_wait_ms=10):
+        self.converter = converter
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, audio, src_se, tgt_se, tau=0.3, message="default", seed=None, timer=None) -> Future:
+        """
+        Queue one utterance (float32 samples at the converter rate) for conversion.
+        If ``timer`` is given, the wait and the batch's stage times are added to it.
+        """
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((audio, src_se, tgt_se, tau, message, future, seed, timer, time.perf_counter()))
+        return future
+
+    def _ensure_worker(self):
+        # Start lazily so the thread is owned by the process that uses it (e.g. after a fork)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="conversion-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+
+            # tau and the watermark message are per-call scalars, so group on them
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[3], item[4]), []).append(item)
+
+            for (tau, message), items in groups.items():
+                items = [item for item in items if item[5].set_running_or_notify_cancel()]
+                if not items:
+                    continue
+                batch_start = time.perf_counter()
+                batch_timer = StageTimer()
+                for item in items:
+                    if item[7] is not None:
+                        item[7].record('batch_wait', batch_start - item[8])
+                try:
+                    CONVERSION_BATCH_SIZE.observe(len(items))
+                    outputs = self.converter.convert_batch(
+                        [item[0] for item in items],
+                        [item[1] for item in items],
+                        [item[2] for item in items],
+                        tau=tau,
+                        message=message,
+                        seeds=[item[6] for item in items],
+                        timer=batch_timer
+                    )
+                    for item, audio in zip(items, outputs):
+                        # The whole batch's stage times are what each of its requests waited for
+                        if item[7] is not None:
+                            for name, seconds in batch_timer.durations.items():
+                                item[7].record(name, seconds, observe=False)
+                        item[5].set_result(audio)
+                except Exception as e:
+                    print(f"Error in batched voice conversion: {e}")
+                    for item in items:
+                        item[5].set_exception(e)
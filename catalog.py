@@ -0,0 +1,135 @@
+import os
+import glob
+import time
+import sqlite3
+import threading
+
+def voice_name(path):
+    """Catalog name of the voice stored at ``path``: its file name without extension"""
+    return os.path.basename(path).rsplit('.', 1)[0]
+
+class VoiceCatalog:
+    """
+    SQLite index of the stored reference voices.
+
+    One row per voice holds the stored file, its audio metadata and content
+    hash, and the state of its tone color embedding. Upload and delete keep
+    it current, so listing (keyset-paginated by name) and lookups are index
+    reads instead of directory scans. Shared safely by several processes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS voices (
+                name TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                format TEXT NOT NULL,
+                duration REAL,
+                sample_rate INTEGER,
+                channels INTEGER,
+                size_bytes INTEGER,
+                audio_hash TEXT,
+                embedding_status TEXT NOT NULL,
+                embedding_hash TEXT,
+                embedding_error TEXT,
+                converter_version TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS voices_embedding_status ON voices (embedding_status)")
+
+    def _connect(self):
+        # One autocommit connection per thread and process (never reused across a fork);
+        # every write below is a single statement
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, name):
+        row = self._connect().execute("SELECT * FROM voices WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, limit=100, after=None):
+        """Up to ``limit`` voices ordered by name, starting after the ``after`` cursor"""
+        rows = self._connect().execute(
+            "SELECT * FROM voices WHERE name > ? ORDER BY name LIMIT ?",
+            (after or '', limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def with_embedding_status(self, status):
+        rows = self._connect().execute("SELECT * FROM voices WHERE embedding_status = ?", (status,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def names(self):
+        return [row[0] for row in self._connect().execute("SELECT name FROM voices")]
+
+    def upsert(self, name, filename, format, duration, sample_rate, channels, size_bytes, audio_hash,
+               embedding_status):
+        """Record a newly stored (or replaced) voice; its embedding state starts over"""
+        now = time.time()
+        self._connect().execute(
+            """
+            INSERT INTO voices (name, filename, format, duration, sample_rate, channels, size_bytes, audio_hash,
+                                embedding_status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                filename = excluded.filename, format = excluded.format, duration = excluded.duration,
+                sample_rate = excluded.sample_rate, channels = excluded.channels,
+                size_bytes = excluded.size_bytes, audio_hash = excluded.audio_hash,
+                embedding_status = excluded.embedding_status, embedding_hash = NULL,
+                embedding_error = NULL, converter_version = NULL, updated_at = excluded.updated_at
+            """,
+            (name, filename, format, duration, sample_rate, channels, size_bytes, audio_hash,
+             embedding_status, now, now)
+        )
+
+    def set_embedding(self, name, status, embedding_hash=None, converter_version=None, error=None,
+                      audio_hash=None):
+        """
+        Record the outcome of an embedding extraction. With ``audio_hash``, only
+        if the voice still has that audio, so a slow extraction of replaced
+        audio cannot overwrite the state of the new upload. Returns False if
+        nothing was updated.
+        """
+        query = ("UPDATE voices SET embedding_status = ?, embedding_hash = ?, converter_version = ?, "
+                 "embedding_error = ?, updated_at = ? WHERE name = ?")
+        params = [status, embedding_hash, converter_version, error, time.time(), name]
+        if audio_hash is not None:
+            query += " AND audio_hash = ?"
+            params.append(audio_hash)
+        return self._connect().execute(query, params).rowcount > 0
+
+    def delete(self, name):
+        """Remove a voice; returns False if it was not in the catalog"""
+        return self._connect().execute("DELETE FROM voices WHERE name = ?", (name,)).rowcount > 0
+
+    def sync(self, folder, describe):
+        """
+        Reconcile the catalog with ``folder`` once at startup: index ``*.mp3``
+        files stored before the catalog existed (``describe(path)`` returns the
+        upsert fields) and drop rows whose file is gone. Returns (added, removed).
+        """
+        files = {voice_name(path): path for path in glob.glob(os.path.join(folder, '*.mp3'))}
+        known = set(self.names())
+        added = removed = 0
+        for name, path in files.items():
+            if name not in known:
+                self.upsert(name=name, **describe(path))
+                added += 1
+        for name in known - set(files):
+            self.delete(name)
+            removed += 1
+        return added, removed
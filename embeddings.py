@@ -0,0 +1,394 @@
+import os
+import json
+import hashlib
+import time
+import fcntl
+import queue
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch
+
+EMBEDDING_PENDING = 'pending'
+EMBEDDING_READY = 'ready'
+EMBEDDING_FAILED = 'failed'
+
+
+def audio_hash_of(audio_path):
+    """
+    The audio hash of a stored voice: sha256 of its file. The catalog, the
+    saved embeddings and the embedding store all identify audio by it.
+    """
+    digest = hashlib.sha256()
+    with open(audio_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def embedding_path(audio_path):
+    """Where the tone color embedding of a reference voice is stored: next to its audio"""
+    return f"{os.path.splitext(audio_path)[0]}.se.pth"
+
+
+def pcm_path(audio_path):
+    """Where the normalized mono float32 PCM copy of a reference voice is stored (an .npy file)"""
+    return f"{os.path.splitext(audio_path)[0]}.pcm.npy"
+
+
+def _failure_path(audio_path):
+    return f"{os.path.splitext(audio_path)[0]}.se.failed"
+
+
+def _lock_path(audio_path):
+    return f"{os.path.splitext(audio_path)[0]}.se.lock"
+
+
+def load_embedding(audio_path, map_location='cpu'):
+    """
+    (embedding, audio hash it was extracted from) of the embedding saved next
+    to a reference voice; the hash is None for files saved before it was recorded.
+    """
+    data = torch.load(embedding_path(audio_path), map_location=map_location)
+    if isinstance(data, dict):
+        return data["se"], data.get("audio_hash")
+    return data, None
+
+
+def _read_failure(audio_path):
+    # (audio hash, error) of a failure record; plain-text records predate the hash
+    with open(_failure_path(audio_path)) as f:
+        content = f.read()
+    try:
+        record = json.loads(content)
+        return record["audio_hash"], record["error"]
+    except (ValueError, KeyError, TypeError):
+        return None, content
+
+
+def embedding_status(audio_path, audio_hash=None):
+    """
+    (status, error) of a reference voice's embedding, read from the files next
+    to it so every worker process agrees: ready once ``.se.pth`` exists, failed
+    with the recorded error, and pending otherwise. With ``audio_hash``, files
+    recorded for other audio (or for unknown audio) count as pending, so an
+    embedding of replaced audio is never reported for its successor.
+    """
+    if os.path.exists(embedding_path(audio_path)):
+        try:
+            if audio_hash is None or load_embedding(audio_path)[1] == audio_hash:
+                return EMBEDDING_READY, None
+        except FileNotFoundError:
+            pass  # removed since
+    try:
+        recorded_hash, error = _read_failure(audio_path)
+    except FileNotFoundError:
+        return EMBEDDING_PENDING, None
+    if audio_hash is None or recorded_hash == audio_hash:
+        return EMBEDDING_FAILED, error
+    return EMBEDDING_PENDING, None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def clear_embedding(audio_path):
+    """Remove a stored embedding and its failure record, e.g. when the audio is replaced"""
+    _remove(embedding_path(audio_path))
+    _remove(_failure_path(audio_path))
+
+
+def discard_embedding(audio_path, audio_hash):
+    """
+    Remove the saved embedding or failure record of a voice if it was made
+    from ``audio_hash``, e.g. by an extraction that finished after the audio
+    was replaced. Files recorded for other audio are left alone.
+    """
+    try:
+        if load_embedding(audio_path)[1] == audio_hash:
+            _remove(embedding_path(audio_path))
+    except FileNotFoundError:
+        pass
+    try:
+        if _read_failure(audio_path)[0] == audio_hash:
+            _remove(_failure_path(audio_path))
+    except FileNotFoundError:
+        pass
+
+
+class EmbeddingQueue:
+    """
+    Background extraction of reference voice embeddings.
+
+    ``extract(audio_path)`` computes the tone color embedding; the queue saves
+    it next to the audio, with the hash of the audio it was extracted from, so
+    generation only has to load it. A lock file keeps two processes from
+    extracting the same voice, and a lock older than ``lock_timeout`` seconds
+    is treated as left over from a crash. A voice whose lock is held is
+    looked at again after a backoff starting at ``retry_delay`` seconds.
+
+    ``on_result(audio_path, audio_hash, se, error)``, if given, is told the
+    outcome of every submitted voice, including ones another process already
+    handled; ``audio_hash`` is what was passed to submit().
+    """
+
+    def __init__(self, extract, num_workers=1, lock_timeout=600, on_result=None, retry_delay=1.0):
+        self.extract = extract
+        self.on_result = on_result
+        self.num_workers = num_workers
+        self.lock_timeout = lock_timeout
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+
+    def submit(self, audio_path, audio_hash=None):
+        """Queue a voice; with ``audio_hash``, saved results of other audio are not taken as its own"""
+        self._ensure_workers()
+        self._queue.put((audio_path, audio_hash, 0))
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def _ensure_workers(self):
+        # Started lazily so the threads belong to the process that uses them (e.g. after a fork)
+        with self._lock:
+            if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for n in range(self.num_workers):
+                thread = threading.Thread(target=self._run, name=f"embedding-worker-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _acquire(self, audio_path):
+        lock_path = _lock_path(audio_path)
+        try:
+            if time.time() - os.path.getmtime(lock_path) > self.lock_timeout:
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def _retry(self, audio_path, audio_hash, attempt):
+        # Exponential backoff, capped where a held lock would be considered stale
+        delay = min(self.lock_timeout, self.retry_delay * 2 ** attempt)
+        timer = threading.Timer(delay, self._queue.put, args=((audio_path, audio_hash, attempt + 1),))
+        timer.daemon = True
+        timer.start()
+
+    def _run(self):
+        while True:
+            audio_path, audio_hash, attempt = self._queue.get()
+            if not os.path.exists(audio_path):
+                continue  # deleted while queued
+            if self._report_done(audio_path, audio_hash):
+                continue  # done before, e.g. by another process or before a restart
+            if not self._acquire(audio_path):
+                # Someone else is extracting it; look again once they may have finished
+                self._retry(audio_path, audio_hash, attempt)
+                continue
+            se = error = None
+            try:
+                # The lock holder we may have waited for could have finished just now
+                if self._report_done(audio_path, audio_hash):
+                    continue
+                start_time = time.time()
+                se = self.extract(audio_path).detach().cpu()
+                # Write under a temporary name so readers never load a truncated tensor
+                path = embedding_path(audio_path)
+                temp_path = f"{path}.{os.getpid()}.part"
+                torch.save({"se": se, "audio_hash": audio_hash}, temp_path)
+                os.replace(temp_path, path)
+                _remove(_failure_path(audio_path))
+                print(f"Embedding for {audio_path} extracted in {time.time() - start_time:.2f} seconds")
+            except Exception as e:
+                print(f"Embedding extraction for {audio_path} failed: {e}")
+                error = str(e)
+                with open(_failure_path(audio_path), 'w') as f:
+                    json.dump({"audio_hash": audio_hash, "error": error}, f)
+                _remove(embedding_path(audio_path))  # of earlier audio
+            finally:
+                os.remove(_lock_path(audio_path))
+            self._report(audio_path, audio_hash, se, error)
+
+    def _report_done(self, audio_path, audio_hash):
+        """Report a voice whose embedding for this audio was already extracted or failed; False if pending"""
+        status, error = embedding_status(audio_path, audio_hash)
+        if status == EMBEDDING_PENDING:
+            return False
+        se = load_embedding(audio_path)[0] if status == EMBEDDING_READY else None
+        self._report(audio_path, audio_hash, se, error)
+        return True
+
+    def _report(self, audio_path, audio_hash, se, error):
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(audio_path, audio_hash, se, error)
+        except Exception as e:
+            print(f"Error recording embedding result for {audio_path}: {e}")
+
+
+class EmbeddingStore:
+    """
+    Persistent tone color embeddings shared by every worker process, keyed by
+    (audio content hash, converter version) so they survive restarts and are
+    never reused across converter checkpoints.
+
+    Embeddings are rows of a raw float32 file that readers memory-map, and
+    ``index.jsonl`` maps each key to its row. Both files are append-only:
+    writers hold an exclusive flock, and readers pick up rows added by other
+    processes by reading the index on from where they stopped.
+    """
+
+    def __init__(self, folder, shape):
+        self.folder = folder
+        self.shape = tuple(shape)
+        self.dim = int(np.prod(self.shape))
+        self._row_bytes = self.dim * 4
+        os.makedirs(folder, exist_ok=True)
+        self._data_path = os.path.join(folder, 'embeddings.f32')
+        self._index_path = os.path.join(folder, 'index.jsonl')
+        self._file_lock_path = os.path.join(folder, 'store.lock')
+        self._lock = threading.Lock()
+        self._index = {}
+        self._offset = 0
+        self._map = None
+        self.stats = {"hits": 0, "misses": 0, "writes": 0}
+        with self._lock:
+            self._refresh()
+
+    @staticmethod
+    def key(content_hash, converter_version):
+        return f"{content_hash}:{converter_version}"
+
+    def _refresh(self):
+        # Read index entries appended since the last refresh; a torn last line is left for later
+        try:
+            with open(self._index_path, 'rb') as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    entry = json.loads(line)
+                    self._index[entry["key"]] = entry["row"]
+                    self._offset += len(line)
+        except FileNotFoundError:
+            pass
+
+    def _read_row(self, row):
+        if self._map is None or row >= self._map.shape[0]:
+            rows = os.path.getsize(self._data_path) // self._row_bytes
+            self._map = np.memmap(self._data_path, dtype='<f4', mode='r', shape=(rows, self.dim))
+        return np.array(self._map[row]).reshape(self.shape)
+
+    def get(self, key):
+        """The embedding stored under ``key`` as a float32 array, or None"""
+        with self._lock:
+            if key not in self._index:
+                self._refresh()
+            row = self._index.get(key)
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return self._read_row(row)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._index:
+                self._refresh()
+            return key in self._index
+
+    def put(self, key, embedding):
+        """Store an embedding; a key that is already present keeps its first value"""
+        embedding = np.ascontiguousarray(embedding, dtype='<f4').reshape(-1)
+        if embedding.size != self.dim:
+            raise ValueError(f"Embedding has {embedding.size} values, expected {self.dim}")
+        with self._lock, open(self._file_lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._refresh()
+            if key in self._index:
+                return
+            with open(self._data_path, 'ab') as f:
+                # Drop a partial row left by a writer that crashed mid-append
+                size = f.tell()
+                if size % self._row_bytes:
+                    f.truncate(size - size % self._row_bytes)
+                row = size // self._row_bytes
+                f.write(embedding.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._index_path, 'ab') as f:
+                line = (json.dumps({"key": key, "row": row}) + '\n').encode('utf-8')
+                f.write(line)
+                f.flush()
+            self._index[key] = row
+            self._offset += len(line)
+            self.stats["writes"] += 1
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._index))
+
+
+class EmbeddingCache:
+    """
+    In-process LRU cache of loaded tone color embeddings, keyed by (voice
+    name, content version) and holding at most ``max_entries`` of them.
+
+    A re-uploaded voice has a new content version, so its old embedding is
+    never served; invalidate(name) drops a voice's entries right away when
+    this process replaces or deletes it.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, name, version):
+        """The cached value for a voice at this content version, or None"""
+        with self._lock:
+            value = self._entries.get((name, version))
+            if value is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end((name, version))
+            self.stats["hits"] += 1
+            return value
+
+    def put(self, name, version, value):
+        with self._lock:
+            # Only the newest version of a voice is worth keeping
+            for key in [key for key in self._entries if key[0] == name and key[1] != version]:
+                del self._entries[key]
+            self._entries[(name, version)] = value
+            self._entries.move_to_end((name, version))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, name):
+        """Drop every cached version of a voice"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == name]:
+                del self._entries[key]
+                self.stats["invalidations"] += 1
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), max_entries=self.max_entries)
@@ -1,104 +1,725 @@
 import os
+import re
+import json
+import time
+import random
+import tempfile
+import hashlib
+import threading
+import contextlib
+import concurrent.futures
 import torch
+import torch.nn.functional as F
+import numpy as np
+import soundfile
 import warnings
 from transformers.utils import logging
 from openvoice import se_extractor
 from openvoice.api import ToneColorConverter
-from melo.api import TTS
+from openvoice.utils import (
+    CancellationToken, GenerationCancelled, LengthBuckets, Pipeline, PipelineStats, SingleFlight, Stage,
+    assemble_audio, check_cancelled
+)
+from melo import utils as melo_utils
+from batching import ConversionBatcher
+from audio_cache import AudioCache
+from catalog import voice_name
+from embeddings import EmbeddingCache, EmbeddingStore, audio_hash_of, load_embedding, pcm_path
+from metrics import StageTimer
+from tts_models import LanguageModel, TTSModelRegistry, detect_language
 
 # Suppress transformer warnings for cleaner output
 logging.set_verbosity_error()
 
+# Representative input lengths for warm_up: one short sentence up to a ~10 second passage
+WARM_UP_TEXTS = (
+    ("short", "Warm up."),
+    ("medium", "This sentence runs the text frontend, the base speaker and the tone color converter."),
+    ("long", "Every lazy path is run once before traffic arrives. "
+             "The first real request should not pay for dictionaries, compiled graphs or resampling filters. "
+             "A passage of several sentences also covers the longer input shapes seen in production, "
+             "and leaves enough speech behind to warm up tone color embedding extraction as well."),
+)
+
+class _RNGGate:
+    """
+    Readers-writer lock around torch's global RNG.
+
+    MeloTTS samples its noise from the global generator, so a seeded run is
+    only reproducible if nothing else draws from it meanwhile. Unseeded runs
+    share the gate; a seeded run holds it exclusively while it reseeds.
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._waiting_exclusive = 0
+    
+    @contextlib.contextmanager
+    def shared(self):
+        with self._cond:
+            # Waiting seeded runs go first so they are not starved
+            while self._exclusive or self._waiting_exclusive:
+                self._cond.wait()
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                self._cond.notify_all()
+    
+    @contextlib.contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._waiting_exclusive += 1
+            while self._exclusive or self._shared:
+                self._cond.wait()
+            self._waiting_exclusive -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+def converter_version(config_path='checkpoints_v2/converter/config.json',
+                      ckpt_path='checkpoints_v2/converter/checkpoint.pth') -> str:
+    """Identity of a converter checkpoint (config version, size and mtime), read without loading it"""
+    with open(config_path) as f:
+        version = json.load(f).get('_version_', "v1")
+    ckpt_stat = os.stat(ckpt_path)
+    return f"{version}:{ckpt_stat.st_size}:{int(ckpt_stat.st_mtime)}"
+
+
 class VoiceGenerator:
     """
     A class for generating voice outputs using OpenVoice and MeloTTS.
     Handles model initialization, caching, and speech generation.
     """
     
-    def __init__(self):
+    def __init__(self, max_batch_size: int = 1, batch_window_ms: float = 10, audio_cache: AudioCache = None,
+                 token_buckets: list = None, frame_buckets: list = None, reference_version=None,
+                 embedding_store_folder: str = None, embedding_cache_size: int = 256, languages: list = None,
+                 default_language: str = 'EN', tts_memory_budget: int = 0, pipeline_queue_size: int = 2):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.output_dir = 'outputs_v2'
-        self.speaker_key = 'en-us'
         os.makedirs(self.output_dir, exist_ok=True)
         
-        # Cache paths for faster access
-        self.temp_path = os.path.join(self.output_dir, 'tmp.wav')
-        self.output_path = os.path.join(self.output_dir, f'output_v2_{self.speaker_key}.wav')
-        
         # Initialize models in constructor with correct config paths
         self.tone_color_converter = ToneColorConverter(
             config_path='checkpoints_v2/converter/config.json',
             device=self.device
         )
-        self.tone_color_converter.load_ckpt('checkpoints_v2/converter/checkpoint.pth')
-        self.model = TTS(language='EN', device=self.device)
+        converter_ckpt = 'checkpoints_v2/converter/checkpoint.pth'
+        self.tone_color_converter.load_ckpt(converter_ckpt)
         
-        # Cache for source embeddings
-        self.source_se_cache = {}
+        # Part of every audio cache key: a new converter checkpoint must not serve old audio
+        self.converter_version = converter_version(ckpt_path=converter_ckpt)
         
-        # Load default source embedding
-        self.source_se = torch.load(
-            f'checkpoints_v2/base_speakers/ses/{self.speaker_key}.pth',
-            map_location=self.device
-        )
+        # Audio stays in memory between TTS and conversion; each base TTS has its own rate
+        self.sampling_rate = self.tone_color_converter.hps.data.sampling_rate
+        
+        # Loaded embeddings and their hashes (for audio cache keys), keyed by voice name and
+        # content version. ``reference_version(path)`` (the voice catalog's audio hash) is the
+        # version, so a re-uploaded voice never gets its old embedding
+        self.source_se_cache = EmbeddingCache(embedding_cache_size)
+        self.reference_version = reference_version
+        self._file_hashes = {}
+        
+        # Embeddings persisted across workers and restarts (see embeddings.EmbeddingStore); None disables it
+        self.embedding_store = None
+        if embedding_store_folder is not None:
+            gin_channels = self.tone_color_converter.hps.model.gin_channels
+            self.embedding_store = EmbeddingStore(embedding_store_folder, shape=(1, gin_channels, 1))
+        
+        # Synthesized audio cache (see audio_cache.AudioCache); None disables it
+        self.audio_cache = audio_cache
+        
+        # Text frontend, TTS and (when streaming) conversion overlap across sentences, each
+        # stage on its own thread with at most ``pipeline_queue_size`` sentences between stages
+        self.pipeline_queue_size = pipeline_queue_size
+        self.pipeline_stats = PipelineStats()
+        
+        # Identical concurrent generations, and extractions of one voice, run once and share the result
+        self.speech_flights = SingleFlight()
+        self.embedding_flights = SingleFlight()
+        self._rng_gate = _RNGGate()
+        
+        # Set once warm_up() has run every lazy path
+        self.ready = threading.Event()
+        self.warm_up_timings = {}
+        self.warm_up_error = None
         
         # Cache target SE extractor settings
         self.se_extract_params = {'vad': True}
         
-        # Enable TorchScript JIT compilation
-        if hasattr(torch, 'compile'):
+        # Micro-batch voice conversion across concurrent requests
+        self.max_batch_size = max(1, max_batch_size)
+        self.conversion_batcher = None
+        if max_batch_size > 1:
+            self.conversion_batcher = ConversionBatcher(
+                self.tone_color_converter,
+                max_batch_size=max_batch_size,
+                max_wait_ms=batch_window_ms
+            )
+        
+        # Shape bucketing: MeloTTS tokens and converter frames are padded up to fixed lengths
+        self.token_buckets = None
+        if token_buckets and frame_buckets:
+            self.token_buckets = LengthBuckets(token_buckets, name="text encoder")
+            self.tone_color_converter.frame_buckets = LengthBuckets(frame_buckets, name="voice conversion")
+        
+        if hasattr(torch, 'compile') and self.token_buckets is not None:
+            # Compile what inference actually calls, one static graph per bucket
+            converter_model = self.tone_color_converter.model
+            converter_model.voice_conversion = torch.compile(converter_model.voice_conversion, dynamic=False)
+        elif hasattr(torch, 'compile'):
+            # Enable TorchScript JIT compilation
             self.tone_color_converter.model = torch.compile(
                 self.tone_color_converter.model,
                 mode="reduce-overhead",
                 fullgraph=True
             )
-            self.model.model = torch.compile(
-                self.model.model,
-                mode="reduce-overhead",
-                fullgraph=True
-            )
+        
+        # Base TTS per language, loaded on first use and unloaded when idle past the memory
+        # budget; the default language is loaded now and stays loaded
+        self.default_language = default_language.upper()
+        self.tts_models = TTSModelRegistry(
+            self.device,
+            languages or [self.default_language],
+            memory_budget=tts_memory_budget,
+            pinned=[self.default_language],
+            prepare=self._prepare_tts
+        )
+        self.tts_models.get(self.default_language)
+
+    def _prepare_tts(self, tts):
+        """Compile a freshly loaded base TTS the same way as the converter"""
+        if not hasattr(torch, 'compile'):
+            return
+        if self.token_buckets is not None:
+            # Past the text encoder MeloTTS's length depends on predicted durations, so it stays eager
+            tts.model.enc_p = torch.compile(tts.model.enc_p, dynamic=False)
+        else:
+            tts.model = torch.compile(tts.model, mode="reduce-overhead", fullgraph=True)
+
+    def resolve_language(self, text: str, language: str = None) -> str:
+        """
+        The requested language, or the one detected from the text's script;
+        a detected language this server does not serve falls back to the default.
+        """
+        if language:
+            return language.upper()
+        detected = detect_language(text, self.default_language)
+        return detected if detected in self.tts_models.languages else self.default_language
+
+    def bucket_info(self):
+        """Bucket sizes, compiled shapes and overflow counts, or None without shape bucketing"""
+        if self.token_buckets is None:
+            return None
+        return {
+            "tokens": self.token_buckets.info(),
+            "frames": self.tone_color_converter.frame_buckets.info()
+        }
 
-    def _warm_up_models(self):
-        """Warm up models with a dummy inference"""
+    def warm_up(self) -> dict:
+        """
+        Run every lazily initialised path once, over a short, a medium and a
+        long input, so the first real request does not pay for it: compiled
+        graphs, text frontend dictionaries, librosa resampling, STFT windows,
+        wavmark and embedding extraction. Returns the seconds spent per step
+        and sets ``self.ready`` when done; failures are kept in ``warm_up_error``.
+        """
+        timings = {}
+        
+        @contextlib.contextmanager
+        def step(name):
+            start = time.perf_counter()
+            yield
+            timings[name] = round(time.perf_counter() - start, 3)
+            print(f"Warm-up step '{name}' took {timings[name]:.2f} seconds")
+        
+        try:
+            with torch.inference_mode():
+                with step('jieba'):
+                    try:
+                        import jieba
+                        jieba.initialize()
+                    except ImportError:
+                        pass
+                
+                # Converting to the base speaker itself needs no reference voice
+                base = self.tts_models.get(self.default_language)
+                audio = None
+                for name, text in WARM_UP_TEXTS:
+                    with step(f'generate_{name}'):
+                        with self._tts_rng():
+                            sentences = self._split_sentences(base, text)
+                            audio = self._assemble(base, [self._synthesize_sentence(base, s, 1.0) for s in sentences])
+                        audio = self._convert(audio, base, base.source_se)
+                
+                # VAD and ref_enc on the longest output, in a throwaway folder
+                with step('se_extraction'), tempfile.TemporaryDirectory() as folder:
+                    path = os.path.join(folder, 'warm_up.wav')
+                    soundfile.write(path, audio, self.sampling_rate)
+                    se_extractor.get_se(path, self.tone_color_converter, target_dir=folder, **self.se_extract_params)
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+            self.warm_up_error = str(e)
+            raise
+        finally:
+            self.warm_up_timings = timings
+        
+        self.ready.set()
+        return timings
+
+    def share_memory(self):
+        """
+        Move CPU model weights into shared memory so forked worker processes
+        map the parent's copy instead of duplicating it. CUDA weights are left
+        alone; they cannot be inherited across fork.
+        """
+        modules = [self.tone_color_converter.model]
+        if self.tone_color_converter.watermark_model is not None:
+            modules.append(self.tone_color_converter.watermark_model)
+        for base in self.tts_models.loaded():
+            modules.append(base.tts.model)
+            base.source_se.share_memory_()
+        for module in modules:
+            module.share_memory()
+
+    def extract_embedding(self, reference_speaker: str):
+        """Run VAD and tone color extraction on a reference voice (slow; see embeddings.EmbeddingQueue)"""
+        return self.embedding_flights.do(
+            (reference_speaker, self._content_hash(reference_speaker)),
+            lambda _: self._extract_embedding(reference_speaker)
+        )
+
+    def _extract_embedding(self, reference_speaker: str):
         with torch.inference_mode():
-            # Generate a simple TTS output without voice conversion
-            dummy_text = "Warm up."
-            self.model.tts_to_file(
-                dummy_text, 
-                speaker_id=0, 
-                output_path=self.temp_path, 
-                speed=1.0
+            # Voices ingested as PCM at the converter rate are read straight from the memory map
+            if os.path.exists(pcm_path(reference_speaker)):
+                audio = np.load(pcm_path(reference_speaker), mmap_mode='r')
+                return se_extractor.get_se_from_array(audio, self.sampling_rate, self.tone_color_converter)
+            return se_extractor.get_se(
+                reference_speaker,
+                self.tone_color_converter,
+                **self.se_extract_params
+            )[0]
+
+    def forget_reference(self, reference_speaker: str):
+        """Drop the in-memory embedding of a reference voice whose audio changed or was removed"""
+        self.source_se_cache.invalidate(voice_name(reference_speaker))
+        self._file_hashes.pop(reference_speaker, None)
+
+    def _content_hash(self, reference_speaker: str) -> str:
+        """The voice catalog's audio hash, or the same hash computed here for voices it does not know"""
+        version = self.reference_version(reference_speaker) if self.reference_version else None
+        if version is not None:
+            return version
+        stat = os.stat(reference_speaker)
+        cached = self._file_hashes.get(reference_speaker)
+        if cached is None or cached[0] != (stat.st_size, stat.st_mtime_ns):
+            cached = ((stat.st_size, stat.st_mtime_ns), audio_hash_of(reference_speaker))
+            self._file_hashes[reference_speaker] = cached
+        return cached[1]
+
+    def _load_embedding(self, reference_speaker: str, version: str):
+        """From the embedding store, else the file saved at upload time, else extracted inline"""
+        key = EmbeddingStore.key(version, self.converter_version)
+        if self.embedding_store is not None:
+            stored = self.embedding_store.get(key)
+            if stored is not None:
+                return torch.from_numpy(stored).to(self.device)
+        try:
+            se, audio_hash = load_embedding(reference_speaker, map_location=self.device)
+        except FileNotFoundError:
+            se = audio_hash = None
+        if audio_hash != version:
+            # Not saved yet, or saved from audio this voice no longer has
+            se = self.extract_embedding(reference_speaker)
+        if self.embedding_store is not None:
+            self.embedding_store.put(key, se.detach().cpu().numpy())
+        return se
+
+    def preload_embeddings(self, reference_speakers: list) -> int:
+        """
+        Copy the saved embeddings of ``reference_speakers`` that match their
+        current audio into the embedding store, so no worker has to load them
+        one file at a time. Returns how many were added.
+        """
+        if self.embedding_store is None:
+            return 0
+        added = 0
+        for reference_speaker in reference_speakers:
+            version = self._content_hash(reference_speaker)
+            key = EmbeddingStore.key(version, self.converter_version)
+            if key in self.embedding_store:
+                continue
+            try:
+                se, audio_hash = load_embedding(reference_speaker)
+            except FileNotFoundError:
+                continue
+            # Only embeddings of the audio the voice has now
+            if audio_hash == version:
+                self.embedding_store.put(key, se.numpy())
+                added += 1
+        return added
+
+    def _target_se_entry(self, reference_speaker: str) -> tuple:
+        """(embedding, embedding hash) of a reference speaker, through the embedding cache"""
+        name = voice_name(reference_speaker)
+        version = self._content_hash(reference_speaker)
+        entry = self.source_se_cache.get(name, version)
+        if entry is None:
+            se = self._load_embedding(reference_speaker, version)
+            entry = (se, hashlib.sha256(se.detach().cpu().numpy().tobytes()).hexdigest())
+            self.source_se_cache.put(name, version, entry)
+        return entry
+
+    def _get_target_se(self, reference_speaker: str):
+        """
+        Return the tone color embedding of a reference speaker: the one
+        precomputed at upload time if there is one, else extracted inline.
+        """
+        return self._target_se_entry(reference_speaker)[0]
+
+    def audio_cache_key(self, text: str, reference_speaker: str, speed: float, seed: int = None,
+                        language: str = None) -> str:
+        """
+        Content address of a generation: the text, the reference voice's
+        embedding (not its path), language, speed, converter version and seed.
+        """
+        language = self.resolve_language(text, language)
+        payload = json.dumps({
+            "text": text,
+            "target_se": self._target_se_entry(reference_speaker)[1],
+            "language": language,
+            "source_se": self.tts_models.get(language).speaker_key,
+            "speed": round(float(speed), 4),
+            "converter": self.converter_version,
+            # Padding changes how MeloTTS draws its noise, so bucketed audio is cached apart
+            "buckets": self.token_buckets.sizes if self.token_buckets is not None else None,
+            "seed": seed
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _tts_rng(self, seed: int = None):
+        """Context for running MeloTTS: reseeded and exclusive with a seed, shared without"""
+        return self._tts_rng_factory(seed)()
+
+    def _tts_rng_factory(self, seed: int = None):
+        """
+        Factory of _tts_rng contexts for running one generation a sentence at a
+        time, so the gate is not held between sentences (e.g. while a stream
+        waits for its client). A seeded generation carries its RNG state from
+        one sentence to the next, drawing the same noise as one long hold.
+        """
+        if seed is None:
+            return self._rng_gate.shared
+        devices = [torch.cuda.current_device()] if self.device == 'cuda' else []
+        state = {}
+        
+        @contextlib.contextmanager
+        def seeded():
+            with self._rng_gate.exclusive(), torch.random.fork_rng(devices=devices):
+                if state:
+                    torch.set_rng_state(state['cpu'])
+                    if devices:
+                        torch.cuda.set_rng_state(state['cuda'])
+                else:
+                    torch.manual_seed(seed)
+                yield
+                state['cpu'] = torch.get_rng_state()
+                if devices:
+                    state['cuda'] = torch.cuda.get_rng_state()
+        return seeded
+
+    @staticmethod
+    def _conversion_seed(seed: int = None) -> int:
+        # Conversion noise always comes from a private generator, keeping it off the global RNG
+        return seed if seed is not None else random.getrandbits(31)
+
+    def _split_sentences(self, base: LanguageModel, text: str, timer: StageTimer = None) -> list:
+        with (timer or StageTimer()).stage('split'):
+            return base.tts.split_sentences_into_pieces(text, base.language, quiet=True)
+
+    def _synthesize_sentence(self, base: LanguageModel, sentence: str, speed: float,
+                             timer: StageTimer = None) -> np.ndarray:
+        """
+        Run MeloTTS on a single sentence, the same way TTS.tts_to_file does for
+        each piece; _assemble adds the silence that follows it.
+        """
+        return self._infer_sentence(base, self._prepare_sentence(base, sentence, timer), speed, timer)
+
+    def _prepare_sentence(self, base: LanguageModel, sentence: str, timer: StageTimer = None) -> tuple:
+        """MeloTTS's text frontend (normalization, phonemes, BERT features) for one sentence"""
+        model = base.tts
+        with (timer or StageTimer()).stage('frontend'):
+            if model.language in ['EN', 'ZH_MIX_EN']:
+                sentence = re.sub(r'([a-z])([A-Z])', r'\1 \2', sentence)
+            return melo_utils.get_text_for_tts_infer(
+                sentence, model.language, model.hps, self.device, model.symbol_to_id
             )
 
+    def _infer_sentence(self, base: LanguageModel, prepared: tuple, speed: float,
+                        timer: StageTimer = None) -> np.ndarray:
+        """MeloTTS inference on the output of _prepare_sentence"""
+        model = base.tts
+        bert, ja_bert, phones, tones, lang_ids = prepared
+        with (timer or StageTimer()).stage('tts'):
+            length = phones.size(0)
+            if self.token_buckets is not None:
+                # Padded tokens are masked out by x_lengths and get zero duration
+                padded = self.token_buckets(length)
+                self.token_buckets.observe((padded,))
+                phones, tones, lang_ids, bert, ja_bert = [
+                    F.pad(t, (0, padded - length)) for t in (phones, tones, lang_ids, bert, ja_bert)
+                ]
+            x_tst = phones.to(self.device).unsqueeze(0)
+            x_tst_lengths = torch.LongTensor([length]).to(self.device)
+            speakers = torch.LongTensor([base.speaker_id]).to(self.device)
+            audio = model.model.infer(
+                x_tst,
+                x_tst_lengths,
+                speakers,
+                tones.to(self.device).unsqueeze(0),
+                lang_ids.to(self.device).unsqueeze(0),
+                bert.to(self.device).unsqueeze(0),
+                ja_bert.to(self.device).unsqueeze(0),
+                sdp_ratio=0.2,
+                noise_scale=0.6,
+                noise_scale_w=0.8,
+                length_scale=1. / speed,
+            )[0][0, 0].data.cpu().float().numpy()
+        return audio
+
+    def _pipeline(self, base: LanguageModel, speed: float, seed: int = None, timer: StageTimer = None,
+                  convert=None) -> Pipeline:
+        """
+        Sentences in, audio out: the text frontend runs ahead of MeloTTS on its
+        own thread, and ``convert(audio)``, if given, tone-converts sentence
+        n-1 on a third thread while sentence n is synthesized.
+        """
+        stages = [
+            Stage('frontend', lambda sentence: self._prepare_sentence(base, sentence, timer), torch.inference_mode),
+            # The RNG gate is taken per sentence on the thread that draws MeloTTS's noise
+            Stage('tts', lambda prepared: self._infer_sentence(base, prepared, speed, timer),
+                  torch.inference_mode, item_context=self._tts_rng_factory(seed))
+        ]
+        if convert is not None:
+            stages.append(Stage('conversion', convert, torch.inference_mode))
+        return Pipeline(stages, queue_size=self.pipeline_queue_size, stats=self.pipeline_stats)
+
+    @staticmethod
+    def _assemble(base: LanguageModel, segments: list, speed: float = 1.0) -> np.ndarray:
+        """Sentence audio joined into one buffer, each followed by TTS.tts_to_file's 50 ms of silence"""
+        return assemble_audio(segments, silence=int((base.sampling_rate * 0.05) / speed))
+
+    def _convert(self, audio: np.ndarray, base: LanguageModel, target_se, cancel_token: CancellationToken = None,
+                 seed: int = None, timer: StageTimer = None, message: str = "@MyShell") -> np.ndarray:
+        """
+        Tone-convert a buffer synthesized by ``base``, through the micro-batcher
+        when it is enabled, watermarked with ``message`` unless it is None.
+        """
+        seed = self._conversion_seed(seed)
+        if self.conversion_batcher is not None:
+            audio = self.tone_color_converter.load_audio(audio, sample_rate=base.sampling_rate)
+            check_cancelled(cancel_token)
+            future = self.conversion_batcher.submit(
+                audio,
+                base.source_se,
+                target_se,
+                message=message,
+                seed=seed,
+                timer=timer
+            )
+            if cancel_token is not None:
+                # Drops the item from its batch if it has not started yet
+                cancel_token.on_cancel(future.cancel)
+            try:
+                return future.result()
+            except concurrent.futures.CancelledError:
+                raise GenerationCancelled()
+        
+        return self.tone_color_converter.convert(
+            audio_src_path=audio,
+            src_se=base.source_se,
+            tgt_se=target_se,
+            output_path=None,
+            message=message,
+            src_sr=base.sampling_rate,
+            cancel_token=cancel_token,
+            seed=seed,
+            timer=timer or StageTimer()
+        )
+
+    def generate_speech(self, text: str, reference_speaker: str, speed: float = 1.0,
+                        cancel_token: CancellationToken = None, seed: int = None,
+                        timer: StageTimer = None, language: str = None) -> np.ndarray:
+        """
+        Generate speech for ``text`` in the voice of ``reference_speaker``.
+        Returns float32 samples at ``self.sampling_rate``; nothing touches disk.
+        ``language`` picks the base TTS; by default it is detected from the text.
+        Raises GenerationCancelled if ``cancel_token`` is cancelled between stages.
+        Stage durations are added to ``timer`` when one is given.
+        """
+        audio, _, _ = self.generate_speech_cached(text, reference_speaker, speed, cancel_token, seed, timer,
+                                                  language)
+        return audio
+
     @torch.inference_mode()
-    def generate_speech(self, text: str, reference_speaker: str, speed: float = 1.0) -> str:
+    def generate_speech_cached(self, text: str, reference_speaker: str, speed: float = 1.0,
+                               cancel_token: CancellationToken = None, seed: int = None,
+                               timer: StageTimer = None, language: str = None):
+        """
+        generate_speech that also reports its audio cache key and whether it
+        was a cache hit: returns ``(audio, key, hit)``. A fixed ``seed`` makes
+        the result reproducible, so a hit is exactly what would be generated.
+        Identical requests in flight at the same time share one generation.
+        """
+        check_cancelled(cancel_token)
+        if timer is None:
+            timer = StageTimer()
+        else:
+            # The caller's timer was started when the request was submitted
+            timer.record_queued()
+        
+        language = self.resolve_language(text, language)
+        try:
+            version = self._content_hash(reference_speaker)
+        except OSError as e:
+            print(f"Error processing reference speaker: {e}")
+            return None, None, False
+        flight_key = (text, reference_speaker, version, round(float(speed), 4), seed, language)
+        
+        def lead(shared_token):
+            result = self._generate_speech_cached(text, reference_speaker, speed, shared_token, seed, timer, language)
+            # Snapshot taken before followers wake up, while nothing else writes to the timer
+            return result, timer, dict(timer.durations)
+        
+        start = time.perf_counter()
+        result, leader_timer, durations = self.speech_flights.do(flight_key, lead, cancel_token)
+        if leader_timer is not timer:
+            # Coalesced: the leader's stages (already in the histogram) are this request's breakdown too
+            timer.record('coalesced', time.perf_counter() - start)
+            for name, seconds in durations.items():
+                if name != 'queued':
+                    timer.record(name, seconds, observe=False)
+        return result
+
+    def _generate_speech_cached(self, text: str, reference_speaker: str, speed: float,
+                                cancel_token: CancellationToken, seed: int, timer: StageTimer, language: str):
         # Get cached source embedding or compute new one
-        if reference_speaker not in self.source_se_cache:
+        try:
+            target_se = self._get_target_se(reference_speaker)
+        except Exception as e:
+            print(f"Error processing reference speaker: {e}")
+            return None, None, False
+        
+        key = None
+        if self.audio_cache is not None:
+            key = self.audio_cache_key(text, reference_speaker, speed, seed, language)
+            cached = self.audio_cache.get(key)
+            if cached is not None:
+                return np.frombuffer(cached, dtype=np.float32), key, True
+        
+        with self.tts_models.use(language) as base:
+            # TTS generation straight into numpy buffers, the frontend a sentence or two ahead
+            sentences = self._split_sentences(base, text, timer)
+            audio_list = list(self._pipeline(base, speed, seed, timer).run(sentences, cancel_token))
+            audio = self._assemble(base, audio_list, speed)
+            check_cancelled(cancel_token)
+            
+            # Voice conversion on the in-memory buffer
+            audio = self._convert(audio, base, target_se, cancel_token=cancel_token, seed=seed, timer=timer)
+        
+        if key is not None:
+            self.audio_cache.put(key, np.ascontiguousarray(audio, dtype=np.float32).tobytes())
+        return audio, key, False
+
+    def generate_speech_stream(self, text: str, reference_speaker: str, speed: float = 1.0,
+                               cancel_token: CancellationToken = None, language: str = None):
+        """
+        Like generate_speech, but synthesizes and converts one sentence at a
+        time and yields each converted chunk as soon as it is ready. The
+        watermark is applied at stream offsets rather than per sentence, so
+        samples inside its windows (within the first ~2.2 s) wait until each
+        window is complete.
+        """
+        with self.tts_models.use(self.resolve_language(text, language)) as base:
+            with torch.inference_mode():
+                target_se = self._get_target_se(reference_speaker)
+                sentences = self._split_sentences(base, text)
+            
+            # Sentence n+1 is prepared and synthesized while sentence n is converted
+            def convert(audio):
+                return self._convert(self._assemble(base, [audio], speed), base, target_se, cancel_token=cancel_token,
+                                     message=None)
+            
+            chunks = self._pipeline(base, speed, convert=convert).run(sentences, cancel_token)
+            yield from self.tone_color_converter.watermark_stream(chunks, "@MyShell", cancel_token)
+
+    @torch.inference_mode()
+    def generate_speech_batch(self, items: list, cancel_token: CancellationToken = None) -> list:
+        """
+        Generate speech for many ``{text, reference_speaker, speed[, language]}`` items in one call.
+
+        Items are grouped by reference speaker and language and sorted by synthesized length
+        so each tone conversion batch carries little padding. Returns one entry
+        per input item, in input order: the float32 audio, or an error string.
+        """
+        results = [None] * len(items)
+        
+        # Items of one group share a source and a target embedding, so they batch together
+        by_speaker = {}
+        for index, item in enumerate(items):
+            language = self.resolve_language(item['text'], item.get('language'))
+            by_speaker.setdefault((item['reference_speaker'], language), []).append(index)
+        
+        for (reference_speaker, language), indices in by_speaker.items():
+            check_cancelled(cancel_token)
             try:
-                self.source_se_cache[reference_speaker] = se_extractor.get_se(
-                    reference_speaker,
-                    self.tone_color_converter,
-                    **self.se_extract_params
-                )[0]
+                target_se = self._get_target_se(reference_speaker)
             except Exception as e:
                 print(f"Error processing reference speaker: {e}")
-                return None
+                for index in indices:
+                    results[index] = "Failed to process reference speaker"
+                continue
+            
+            with self.tts_models.use(language) as base:
+                # Base TTS per item, resampled to the converter rate
+                tts_audio = {}
+                for index in indices:
+                    audio_list = []
+                    with self._tts_rng():
+                        for sentence in self._split_sentences(base, items[index]['text']):
+                            check_cancelled(cancel_token)
+                            audio_list.append(self._synthesize_sentence(base, sentence, items[index]['speed']))
+                    tts_audio[index] = self.tone_color_converter.load_audio(
+                        self._assemble(base, audio_list, items[index]['speed']), sample_rate=base.sampling_rate
+                    )
                 
-        target_se = self.source_se_cache[reference_speaker]
-        
-        # TTS generation
-        self.model.tts_to_file(text, speaker_id=0, output_path=self.temp_path, speed=speed)
-        
-        # Voice conversion
-        self.tone_color_converter.convert(
-            audio_src_path=self.temp_path,
-            src_se=self.source_se,
-            tgt_se=target_se,
-            output_path=self.output_path,
-            message="@MyShell"
-        )
+                # Similar lengths end up in the same conversion batch
+                ordered = sorted(indices, key=lambda i: len(tts_audio[i]))
+                for start in range(0, len(ordered), self.max_batch_size):
+                    check_cancelled(cancel_token)
+                    chunk = ordered[start:start + self.max_batch_size]
+                    outputs = self.tone_color_converter.convert_batch(
+                        [tts_audio[i] for i in chunk],
+                        [base.source_se] * len(chunk),
+                        [target_se] * len(chunk),
+                        message="@MyShell",
+                        seeds=[self._conversion_seed() for _ in chunk],
+                        timer=StageTimer()
+                    )
+                    for index, audio in zip(chunk, outputs):
+                        results[index] = audio
         
-        return self.output_path
+        return results
 
 # def main():
 #     """Main function demonstrating the usage of VoiceGenerator."""
@@ -107,8 +728,8 @@ class VoiceGenerator:
 #     sample_text = "In the year 2194, Earth had gone eerily silent, its once vibrant transmissions reduced to a blanket of static across the stars. From her isolated moonbase orbiting Europa, Lira Sol sent out daily pings into the void, a ritual of hope more than protocol. Then, one evening, through the crackle of cosmic noise, a voice emerged-faint, metallic, yet unmistakably human: 'Lira... this is Kairo. I'm on Mars. You're not alone.' Her heart pounded, but something about the voice felt off-too smooth, too precise, as if it weren't entirely real."
 #     reference_speaker = "resources/example_reference.mp3"
     
-#     output_path = generator.generate_speech(sample_text, reference_speaker)
-#     print(f"Generated speech saved to: {output_path}")
+#     audio = generator.generate_speech(sample_text, reference_speaker)
+#     print(f"Generated {len(audio) / generator.sampling_rate:.2f} seconds of speech")
 
 # if __name__ == "__main__":
 #     main()
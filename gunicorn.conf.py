@@ -0,0 +1,56 @@
+# Pre-fork serving mode: gunicorn -c gunicorn.conf.py app:app
+#
+# The parent process imports app.py (loading ToneColorConverter, MeloTTS and
+# wavmark once), warms the lazy text frontends up and moves the weights into
+# shared memory. Workers are then forked from it and map those pages instead
+# of loading their own copy, so N workers cost far less than N times the RSS.
+import os
+import torch
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8585)}"
+
+# CUDA cannot be initialised before fork, so on GPU every worker loads its own models
+cuda = torch.cuda.is_available()
+preload_app = not cuda
+workers = int(os.environ.get('WEB_WORKERS', 1 if cuda else max(1, (os.cpu_count() or 1) // 2)))
+
+# Each worker keeps its own request threads in front of its inference executor
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = 120
+
+
+def on_starting(server):
+    # Once-per-server state fixes run here in the master: a worker booting later must not
+    # reset jobs its siblings are running, nor invalidate embeddings they have preloaded
+    from helpers import JOBS_FOLDER, invalidate_foreign_embeddings
+    from generator import converter_version
+    from jobs import JobStore
+    requeued = JobStore(JOBS_FOLDER).requeue_running()
+    if requeued:
+        server.log.info("Requeued %d unfinished job(s)", requeued)
+    invalidated = invalidate_foreign_embeddings(converter_version())
+    if invalidated:
+        server.log.info("Re-extracting %d embedding(s) of another converter checkpoint", invalidated)
+
+    if not preload_app:
+        return
+    import app
+    # Run every lazy path once so what gets shared is the fully loaded state
+    app.generator.warm_up()
+    app.generator.share_memory()
+    server.log.info("Model weights moved to shared memory for %d workers", workers)
+
+
+def post_fork(server, worker):
+    # Split the CPU between workers instead of letting every one of them use all cores
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    import app
+    app.start_background_workers()
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges from the shared Prometheus directory
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
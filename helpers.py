@@ -1,37 +1,325 @@
+import io
 import os
+import json
+import zipfile
 import time
+import struct
+import subprocess
+import soundfile
+import numpy as np
 from flask import jsonify
+from werkzeug.utils import secure_filename
 from pydub import AudioSegment
-from functools import lru_cache
+from embeddings import EMBEDDING_PENDING, EMBEDDING_READY, audio_hash_of, clear_embedding, embedding_status, pcm_path
+from catalog import VoiceCatalog, voice_name as reference_voice_name
 
 # Configure constants
 UPLOAD_FOLDER = 'resources'
 ALLOWED_EXTENSIONS = {'mp3', 'wav'}
 MINIMUM_AUDIO_LENGTH = 30  # minimum length in seconds
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 1))  # voice conversion micro-batch size; 1 disables batching
+BATCH_WINDOW_MS = float(os.environ.get('BATCH_WINDOW_MS', 10))  # how long to wait for a batch to fill
+INFERENCE_QUEUE_SIZE = int(os.environ.get('INFERENCE_QUEUE_SIZE', 16))  # async server: pending jobs before 429
+MODEL_WORKERS = int(os.environ.get('MODEL_WORKERS', min(4, (os.cpu_count() or 1))))  # async server: inference workers
+GENERATION_TIMEOUT = 10  # seconds a synchronous request may wait for generation
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 256))  # items accepted by /generate-audio/batch
+BATCH_GENERATION_TIMEOUT = int(os.environ.get('BATCH_GENERATION_TIMEOUT', 300))  # seconds for a whole batch
+ENCODER_WORKERS = int(os.environ.get('ENCODER_WORKERS', 2))  # threads compressing responses off the inference pool
+AUDIO_CACHE_MEMORY_MB = int(os.environ.get('AUDIO_CACHE_MEMORY_MB', 256))  # in-memory tier of the audio cache
+AUDIO_CACHE_DISK_MB = int(os.environ.get('AUDIO_CACHE_DISK_MB', 2048))  # on-disk tier; 0 disables it
+AUDIO_CACHE_FOLDER = os.environ.get('AUDIO_CACHE_FOLDER', 'cache/audio')
+JOBS_FOLDER = os.environ.get('JOBS_FOLDER', 'jobs')  # job database and finished job audio
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))  # background threads running queued jobs
+VOICE_CATALOG_PATH = os.environ.get('VOICE_CATALOG_PATH', os.path.join(UPLOAD_FOLDER, 'voices.db'))
+EMBEDDING_STORE_FOLDER = os.environ.get('EMBEDDING_STORE_FOLDER', 'cache/embeddings')  # shared speaker embeddings
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 256))  # speaker embeddings kept in memory
+# Base TTS languages served, loaded on first use, e.g. "EN, ZH"
+TTS_LANGUAGES = [
+    language.strip().upper() for language in os.environ.get('TTS_LANGUAGES', 'EN').split(',') if language.strip()
+] or ['EN']
+DEFAULT_LANGUAGE = os.environ.get('DEFAULT_LANGUAGE', TTS_LANGUAGES[0]).strip().upper()  # Latin-script text without 'language'
+if DEFAULT_LANGUAGE not in TTS_LANGUAGES:
+    raise SystemExit(f"DEFAULT_LANGUAGE={DEFAULT_LANGUAGE} must be one of TTS_LANGUAGES ({', '.join(TTS_LANGUAGES)})")
+TTS_MEMORY_BUDGET_MB = int(os.environ.get('TTS_MEMORY_BUDGET_MB', 0))  # base TTS and BERT weights kept loaded; 0 for no limit
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 2))  # sentences queued between pipeline stages
+VOICE_PAGE_SIZE = 100  # default page size of GET /reference-voices
+VOICE_PAGE_MAX = 1000
+SHAPE_BUCKETING = os.environ.get('SHAPE_BUCKETING', '0') == '1'  # pad inputs to fixed lengths for compiled graphs
+TOKEN_BUCKETS = [int(n) for n in os.environ.get('TOKEN_BUCKETS', '32,64,96,128,192,256,384,512').split(',')]
+FRAME_BUCKETS = [int(n) for n in os.environ.get('FRAME_BUCKETS', '128,256,384,512,768,1024,1536,2048,3072,4096').split(',')]
 
 def allowed_file(filename):
     """Check if the file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def convert_to_mp3(input_path, output_path):
-    """Convert any audio file to MP3 format"""
-    audio = AudioSegment.from_file(input_path)
-    audio.export(output_path, format='mp3', bitrate='192k')
+def describe_voice_file(filepath, audio=None):
+    """Catalog fields of a stored voice file; ``audio`` is its AudioSegment if already decoded"""
+    if audio is None:
+        audio = AudioSegment.from_file(filepath)
+    audio_hash = audio_hash_of(filepath)
+    status, _ = embedding_status(filepath, audio_hash)
+    return {
+        "filename": os.path.basename(filepath),
+        "format": filepath.rsplit('.', 1)[1],
+        "duration": len(audio) / 1000,
+        "sample_rate": audio.frame_rate,
+        "channels": audio.channels,
+        "size_bytes": os.path.getsize(filepath),
+        "audio_hash": audio_hash,
+        "embedding_status": status
+    }
+
+def ingest_audio(input_path, mp3_path, sample_rate):
+    """
+    Decode an audio file once with ffmpeg, producing both an archival MP3 at
+    ``mp3_path`` and mono float32 samples at ``sample_rate``, which are read
+    from ffmpeg's output pipe as they are decoded.
+    """
+    process = subprocess.Popen(
+        [
+            'ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', input_path,
+            '-map', '0:a:0', '-ac', '1', '-ar', str(sample_rate), '-f', 'f32le', 'pipe:1',
+            '-map', '0:a:0', '-b:a', '192k', '-f', 'mp3', mp3_path
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    pcm = bytearray()
+    for chunk in iter(lambda: process.stdout.read(1 << 16), b''):
+        pcm += chunk
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"Could not decode audio: {stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(bytes(pcm), dtype='<f4')
+
+def save_reference_voice(upload_path, name, sample_rate):
+    """
+    Validate an uploaded audio file and store it as ``<name>.mp3`` plus a
+    memory-mappable mono PCM copy at ``sample_rate`` (the converter rate),
+    then record it in the voice catalog. The upload is decoded only once.
+    Returns the stored filename, or None if the audio is too short.
+    """
+    # Define the final MP3 filename and path
+    filename = secure_filename(f"{name}.mp3")
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+
+    temp_path = f"{filepath}.part"
+    try:
+        pcm = ingest_audio(upload_path, temp_path, sample_rate)
+        if len(pcm) / sample_rate < MINIMUM_AUDIO_LENGTH:
+            return None
+        os.replace(temp_path, filepath)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    # An embedding of the audio this replaces no longer applies
+    clear_embedding(filepath)
+    temp_path = f"{pcm_path(filepath)}.part"
+    with open(temp_path, 'wb') as f:
+        np.save(f, pcm)
+    os.replace(temp_path, pcm_path(filepath))
+
+    voice_catalog.upsert(
+        name=filename.rsplit('.', 1)[0],
+        filename=filename,
+        format='mp3',
+        duration=len(pcm) / sample_rate,
+        sample_rate=sample_rate,
+        channels=1,
+        size_bytes=os.path.getsize(filepath),
+        audio_hash=audio_hash_of(filepath),
+        embedding_status=EMBEDDING_PENDING
+    )
+    return filename
+
+def voice_view(row):
+    """Public view of a catalog row"""
+    voice = {
+        "name": row["name"],
+        "filename": row["filename"],
+        "format": row["format"],
+        "duration": row["duration"],
+        "sample_rate": row["sample_rate"],
+        "channels": row["channels"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "embedding": row["embedding_status"]
+    }
+    if row["embedding_hash"]:
+        voice["embedding_hash"] = row["embedding_hash"]
+        voice["converter_version"] = row["converter_version"]
+    if row["embedding_error"]:
+        voice["embedding_error"] = row["embedding_error"]
+    return voice
+
+def list_reference_voice_files(limit=VOICE_PAGE_SIZE, after=None):
+    """One page of stored reference voices from the catalog, ordered by name"""
+    return [voice_view(row) for row in voice_catalog.list(limit=limit, after=after)]
+
+def pending_reference_voices():
+    """Paths of stored reference voices whose embedding has not been extracted yet"""
+    return [
+        os.path.join(UPLOAD_FOLDER, row["filename"])
+        for row in voice_catalog.with_embedding_status(EMBEDDING_PENDING)
+    ]
+
+def ready_reference_voices(converter_version):
+    """Paths of stored reference voices whose embedding was extracted by this converter"""
+    return [
+        os.path.join(UPLOAD_FOLDER, row["filename"])
+        for row in voice_catalog.with_embedding_status(EMBEDDING_READY)
+        if row["converter_version"] == converter_version
+    ]
 
-def check_audio_length(file_path):
-    """Check if audio file meets minimum length requirement"""
-    audio = AudioSegment.from_file(file_path)
-    duration_seconds = len(audio) / 1000  # Convert milliseconds to seconds
-    return duration_seconds >= MINIMUM_AUDIO_LENGTH
+def invalidate_foreign_embeddings(converter_version):
+    """
+    Send voices whose embedding was extracted by another converter checkpoint
+    back to pending and remove their saved files, so they are extracted again.
+    Run once per server start, before workers queue pending voices. Returns
+    how many voices were invalidated.
+    """
+    invalidated = 0
+    for row in voice_catalog.with_embedding_status(EMBEDDING_READY):
+        if row["converter_version"] != converter_version:
+            clear_embedding(os.path.join(UPLOAD_FOLDER, row["filename"]))
+            voice_catalog.set_embedding(row["name"], EMBEDDING_PENDING, audio_hash=row["audio_hash"])
+            invalidated += 1
+    return invalidated
+
+def remove_reference_voice(name):
+    """Delete a stored reference voice. Returns False if it does not exist"""
+    row = voice_catalog.get(name)
+    if row is None:
+        return False
+    filepath = os.path.join(UPLOAD_FOLDER, row["filename"])
+    voice_catalog.delete(name)
+    for path in (filepath, pcm_path(filepath)):
+        if os.path.exists(path):
+            os.remove(path)
+    clear_embedding(filepath)
+    return True
 
-# Cache reference speaker embeddings
-@lru_cache(maxsize=32)
 def get_cached_reference_speaker(reference_name):
-    """Get cached reference speaker path"""
-    return f"{UPLOAD_FOLDER}/{reference_name}.mp3"
+    """Path of a stored reference voice, or None if the catalog does not know it"""
+    row = voice_catalog.get(reference_name)
+    if row is None:
+        return None
+    return os.path.join(UPLOAD_FOLDER, row["filename"])
 
-def make_response(status="ok", data=None, error=None, http_code=200):
-    """Create a standardized JSON response"""
+def reference_voice_version(reference_speaker):
+    """Content hash of the voice stored at a path, as recorded in the catalog; None if unknown"""
+    row = voice_catalog.get(reference_voice_name(reference_speaker))
+    return row["audio_hash"] if row else None
+
+# Output formats for /generate-audio: mimetype and file extension
+OUTPUT_FORMATS = {
+    'wav': ('audio/wav', 'wav'),
+    'pcm16': ('audio/L16', 'pcm'),
+    'flac': ('audio/flac', 'flac'),
+    'ogg': ('audio/ogg', 'ogg'),
+    'mp3': ('audio/mpeg', 'mp3'),
+}
+FORMAT_ALIASES = {'opus': 'ogg', 'mpeg': 'mp3', 'pcm': 'pcm16'}
+
+def is_valid_seed(seed):
+    """A request's 'seed' is absent or an integer; bool is an int subclass, but a JSON true/false is not a seed"""
+    return seed is None or (isinstance(seed, int) and not isinstance(seed, bool))
+
+def resolve_output_format(requested, accept_mimetypes=None):
+    """
+    Pick the output format from an explicit request field, falling back to the
+    Accept header and then to WAV. Returns None for an unknown explicit format,
+    including one that is not a string.
+    """
+    if requested is not None and not isinstance(requested, str):
+        return None
+    if requested:
+        requested = requested.lower()
+        requested = FORMAT_ALIASES.get(requested, requested)
+        return requested if requested in OUTPUT_FORMATS else None
+    if accept_mimetypes:
+        by_mimetype = {mimetype: fmt for fmt, (mimetype, _) in OUTPUT_FORMATS.items()}
+        best = accept_mimetypes.best_match(list(by_mimetype), default='audio/wav')
+        return by_mimetype.get(best, 'wav')
+    return 'wav'
+
+def encode_audio(audio, sample_rate, fmt):
+    """
+    Encode float32 samples entirely in memory. Returns (bytes, mimetype).
+    Opus and MP3 go through pydub/ffmpeg, which also resamples for Opus.
+    """
+    mimetype, _ = OUTPUT_FORMATS[fmt]
+    if fmt == 'wav':
+        return audio_to_wav_bytes(audio, sample_rate).getvalue(), mimetype
+    if fmt == 'pcm16':
+        return float_to_pcm16(audio), f"{mimetype}; rate={sample_rate}; channels=1"
+    if fmt == 'flac':
+        buffer = io.BytesIO()
+        soundfile.write(buffer, audio, sample_rate, format='FLAC', subtype='PCM_16')
+        return buffer.getvalue(), mimetype
+
+    segment = AudioSegment(
+        data=float_to_pcm16(audio),
+        sample_width=2,
+        frame_rate=sample_rate,
+        channels=1
+    )
+    buffer = io.BytesIO()
+    if fmt == 'ogg':
+        segment.export(buffer, format='ogg', codec='libopus', bitrate='32k', parameters=['-ar', '24000'])
+    else:
+        segment.export(buffer, format='mp3', bitrate='64k')
+    return buffer.getvalue(), mimetype
+
+def audio_to_wav_bytes(audio, sample_rate):
+    """Encode a numpy audio buffer as an in-memory WAV file"""
+    buffer = io.BytesIO()
+    soundfile.write(buffer, audio, sample_rate, format='WAV')
+    buffer.seek(0)
+    return buffer
+
+def make_audio_archive(results, items, sample_rate):
+    """
+    Pack batch results into an in-memory ZIP: one WAV per successful item plus
+    a manifest.json describing every item (including failures) in input order.
+    """
+    manifest = []
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for index, (item, result) in enumerate(zip(items, results)):
+            entry = {
+                "index": index,
+                "reference_speaker": item['reference_speaker'],
+                "speed": item['speed']
+            }
+            if isinstance(result, np.ndarray):
+                filename = f"{index:04d}_{secure_filename(item['reference_speaker'])}.wav"
+                archive.writestr(filename, audio_to_wav_bytes(result, sample_rate).getvalue())
+                entry.update(status="ok", filename=filename, duration=len(result) / sample_rate)
+            else:
+                entry.update(status="error", error=result or "Generation failed")
+            manifest.append(entry)
+        archive.writestr('manifest.json', json.dumps({"items": manifest}, indent=2))
+    buffer.seek(0)
+    return buffer
+
+def float_to_pcm16(audio):
+    """Convert float32 samples in [-1, 1] to little-endian 16-bit PCM bytes"""
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+def wav_stream_header(sample_rate, channels=1, bits_per_sample=16):
+    """WAV header for a PCM stream whose total length is not known up front"""
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return (
+        b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b'data' + struct.pack('<I', 0xFFFFFFFF)
+    )
+
+def response_body(status="ok", data=None, error=None):
+    """Build the standardized JSON response envelope"""
     response = {
         "status": status,
         "timestamp": time.time()
@@ -40,7 +328,14 @@ def make_response(status="ok", data=None, error=None, http_code=200):
         response["data"] = data
     if error is not None:
         response["error"] = error
-    return jsonify(response), http_code
+    return response
+
+def make_response(status="ok", data=None, error=None, http_code=200):
+    """Create a standardized JSON response"""
+    return jsonify(response_body(status, data, error)), http_code
 
 # Create upload folder if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
\ No newline at end of file
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+# Index of stored reference voices; the single source of truth for lookups
+voice_catalog = VoiceCatalog(VOICE_CATALOG_PATH)
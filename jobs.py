@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class JobStore:
+    """
+    SQLite-backed store for asynchronous generation jobs.
+
+    Job state lives in ``<folder>/jobs.db`` and finished audio in
+    ``<folder>/<job_id>.wav``, so both survive a worker restart. Claiming a
+    job is a single IMMEDIATE transaction, which keeps it safe when several
+    workers (threads or processes) share the same database.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.db_path = os.path.join(folder, 'jobs.db')
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    error TEXT,
+                    audio_path TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    def _connect(self, immediate=False):
+        # One connection per thread and process; sqlite3 connections must not be
+        # shared across threads, nor reused in a child forked after opening one
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return _Transaction(conn, immediate)
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def audio_path(self, job_id):
+        return os.path.join(self.folder, f"{job_id}.wav")
+
+    def create(self, params):
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, params, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, json.dumps(params), time.time())
+            )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def claim_next(self):
+        """Atomically move the oldest queued job to running and return it"""
+        with self._connect(immediate=True) as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+                (JOB_RUNNING, time.time(), row['id'])
+            )
+        return self.get(row['id'])
+
+    def complete(self, job_id, audio_path):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, audio_path = ?, finished_at = ? WHERE id = ?",
+                (JOB_DONE, audio_path, time.time(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (JOB_FAILED, error, time.time(), job_id)
+            )
+
+    def requeue_running(self):
+        """Put jobs left running by a previous process back in the queue"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?",
+                (JOB_QUEUED, JOB_RUNNING)
+            )
+            return cursor.rowcount
+
+    def queued_count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_QUEUED,)).fetchone()[0]
+
+
+class _Transaction:
+    """Context manager running a block in one SQLite transaction on an autocommit connection"""
+
+    def __init__(self, conn, immediate=False):
+        self.conn = conn
+        self.immediate = immediate
+
+    def __enter__(self):
+        # IMMEDIATE takes the write lock up front so concurrent claims cannot race
+        self.conn.execute("BEGIN IMMEDIATE" if self.immediate else "BEGIN")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class JobWorkers:
+    """
+    Background threads draining a JobStore.
+
+    ``handler(job)`` does the actual work and returns the path of the
+    finished audio; any exception marks the job as failed.
+    """
+
+    def __init__(self, store, handler, num_workers=1, poll_interval=1.0):
+        self.store = store
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._threads = []
+
+    def start(self):
+        # Requeueing jobs left over from a previous run is the caller's job: with several
+        # worker processes, only one of them may do it and only before any job is claimed
+        for n in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        """Wake idle workers after a job has been submitted"""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            job = self.store.claim_next()
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            try:
+                start_time = time.time()
+                audio_path = self.handler(job)
+                self.store.complete(job['id'], audio_path)
+                print(f"Job {job['id']} finished in {time.time() - start_time:.2f} seconds")
+            except Exception as e:
+                print(f"Job {job['id']} failed: {e}")
+                self.store.fail(job['id'], str(e))
@@ -0,0 +1,278 @@
+"""
+Load-test and replay harness for the voice generation API.
+
+Drives /generate-audio (or /generate-audio/stream) with open-loop Poisson
+arrivals, so a slow server does not slow the offered load down, and reports
+throughput, latency and time-to-first-byte percentiles and error/timeout
+rates. Only the standard library is used, so it runs from any machine.
+
+Examples:
+    python loadtest.py --rate 2 --duration 60 --speakers alice:3,bob:1
+    python loadtest.py --rate 5 --lengths 8:0.6,40:0.3,120:0.1 --output run.json
+    python loadtest.py --replay requests.log.jsonl --speedup 2
+
+A replay log has one JSON request body per line ({text, reference_speaker,
+speed, ...}); an optional "offset" field (seconds since the first request)
+keeps the original arrival times, otherwise --rate is used.
+"""
+import argparse
+import http.client
+import json
+import math
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+WORDS = (
+    "the voice of the station carried across the quiet harbor while engineers checked every signal "
+    "before the morning shift began and a light rain settled over the city streets as the first train "
+    "left the platform on time with passengers reading news about distant markets and new discoveries"
+).split()
+
+
+def parse_weights(spec, cast=str):
+    """'a:3,b:1' -> ([a, b], [3.0, 1.0]); a missing weight counts as 1"""
+    values, weights = [], []
+    for part in spec.split(','):
+        value, _, weight = part.partition(':')
+        values.append(cast(value.strip()))
+        weights.append(float(weight) if weight else 1.0)
+    return values, weights
+
+
+def make_text(words, rng):
+    """Pseudo-sentences of roughly ``words`` words"""
+    sentences = []
+    remaining = words
+    while remaining > 0:
+        length = min(remaining, rng.randint(6, 16))
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(length))
+        sentences.append(sentence[0].upper() + sentence[1:] + '.')
+        remaining -= length
+    return ' '.join(sentences)
+
+
+def synthetic_requests(args):
+    """Endless (offset, body) pairs with exponential inter-arrival times at ``args.rate``"""
+    rng = random.Random(args.random_seed)
+    speakers, speaker_weights = parse_weights(args.speakers)
+    lengths, length_weights = parse_weights(args.lengths, int)
+    offset = 0.0
+    while True:
+        body = {
+            "text": make_text(rng.choices(lengths, length_weights)[0], rng),
+            "reference_speaker": rng.choices(speakers, speaker_weights)[0],
+            "speed": args.speed
+        }
+        if args.format:
+            body["format"] = args.format
+        yield offset, body
+        offset += rng.expovariate(args.rate)
+
+
+def replay_requests(args):
+    """(offset, body) pairs from a JSONL log, at its own offsets (scaled by --speedup) or at --rate"""
+    rng = random.Random(args.random_seed)
+    offset = 0.0
+    with open(args.replay) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            body = json.loads(line)
+            if 'offset' in body:
+                offset = float(body.pop('offset')) / args.speedup
+            yield offset, body
+            if args.rate:
+                offset += rng.expovariate(args.rate)
+
+
+class Recorder:
+    """Thread-safe collection of per-request results"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = []
+        self.dropped = 0
+
+    def add(self, result):
+        with self.lock:
+            self.results.append(result)
+
+    def drop(self):
+        with self.lock:
+            self.dropped += 1
+
+
+def send_request(target, endpoint, body, timeout):
+    """One POST; returns a result dict with status, latency, ttfb and error kind"""
+    result = {"start": time.time(), "status": None, "error": None, "ttfb": None, "bytes": 0,
+              "audio_duration": None, "cache": None}
+    start = time.perf_counter()
+    connection_class = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+    conn = connection_class(target.hostname, target.port, timeout=timeout)
+    try:
+        conn.request('POST', endpoint, body=json.dumps(body), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        result["ttfb"] = time.perf_counter() - start
+        result["status"] = response.status
+        # Streamed bodies arrive in pieces; read them all so latency covers the whole response
+        while True:
+            chunk = response.read(65536)
+            if not chunk:
+                break
+            result["bytes"] += len(chunk)
+        if response.getheader('X-Audio-Duration'):
+            result["audio_duration"] = float(response.getheader('X-Audio-Duration'))
+        result["cache"] = response.getheader('X-Cache')
+        if response.status >= 400:
+            result["error"] = f"http_{response.status}"
+    except TimeoutError:
+        result["error"] = "timeout"
+    except OSError as e:
+        result["error"] = type(e).__name__
+    finally:
+        conn.close()
+    result["latency"] = time.perf_counter() - start
+    return result
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list; None when empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(recorder, elapsed):
+    results = recorder.results
+    ok = [r for r in results if r["error"] is None]
+    statuses = {}
+    for r in results:
+        key = str(r["status"]) if r["status"] is not None else r["error"]
+        statuses[key] = statuses.get(key, 0) + 1
+    latencies = [r["latency"] for r in ok]
+    ttfbs = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    audio = sum(r["audio_duration"] or 0 for r in ok)
+    sent = len(results) + recorder.dropped
+
+    def stats(values):
+        return {
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else None
+        }
+
+    return {
+        "elapsed": elapsed,
+        "sent": sent,
+        "completed": len(ok),
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+        "audio_seconds_per_second": audio / elapsed if elapsed else 0.0,
+        "latency": stats(latencies),
+        "ttfb": stats(ttfbs),
+        "error_rate": (sent - len(ok)) / sent if sent else 0.0,
+        "timeout_rate": sum(1 for r in results if r["error"] == "timeout") / sent if sent else 0.0,
+        "dropped": recorder.dropped,
+        "cache_hits": sum(1 for r in ok if r["cache"] == "HIT"),
+        "statuses": statuses
+    }
+
+
+def print_summary(summary):
+    def ms(value):
+        return f"{value * 1000:8.0f} ms" if value is not None else "       -"
+
+    print(f"\nSent {summary['sent']} requests in {summary['elapsed']:.1f} s, "
+          f"{summary['completed']} succeeded ({summary['throughput']:.2f} req/s, "
+          f"{summary['audio_seconds_per_second']:.2f} s of audio per second)")
+    print(f"{'':10}{'p50':>11}{'p95':>11}{'p99':>11}{'max':>11}")
+    for name in ('latency', 'ttfb'):
+        row = summary[name]
+        print(f"{name:10}{ms(row['p50'])} {ms(row['p95'])} {ms(row['p99'])} {ms(row['max'])}")
+    print(f"Error rate {summary['error_rate']:.1%}, timeout rate {summary['timeout_rate']:.1%}, "
+          f"dropped client-side {summary['dropped']}, cache hits {summary['cache_hits']}")
+    print("Statuses: " + ", ".join(f"{k}={v}" for k, v in sorted(summary['statuses'].items())))
+
+
+def run(args):
+    target = urlsplit(args.url)
+    arrivals = replay_requests(args) if args.replay else synthetic_requests(args)
+    recorder = Recorder()
+    in_flight = threading.BoundedSemaphore(args.max_in_flight)
+    threads = []
+
+    def worker(body):
+        try:
+            recorder.add(send_request(target, args.endpoint, body, args.timeout))
+        finally:
+            in_flight.release()
+
+    start = time.perf_counter()
+    for count, (offset, body) in enumerate(arrivals):
+        if args.requests and count >= args.requests:
+            break
+        if args.duration and offset >= args.duration:
+            break
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        # Open loop: never wait for a free slot, count the request as dropped instead
+        if not in_flight.acquire(blocking=False):
+            recorder.drop()
+            continue
+        thread = threading.Thread(target=worker, args=(body,), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+    return summarize(recorder, time.perf_counter() - start), recorder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the voice generation API")
+    parser.add_argument('--url', default='http://localhost:8585', help="server base URL")
+    parser.add_argument('--endpoint', default='/generate-audio',
+                        help="/generate-audio or /generate-audio/stream")
+    parser.add_argument('--rate', type=float, default=1.0, help="mean arrivals per second (Poisson)")
+    parser.add_argument('--duration', type=float,
+                        help="seconds of arrivals; 0 for no limit (default: 60 for synthetic traffic, "
+                             "the whole log for --replay)")
+    parser.add_argument('--requests', type=int, default=0, help="stop after this many requests; 0 for no limit")
+    parser.add_argument('--speakers', default='example_reference',
+                        help="reference voice mix, e.g. alice:3,bob:1")
+    parser.add_argument('--lengths', default='8:0.5,30:0.35,100:0.15',
+                        help="text length mix in words, e.g. 8:0.5,30:0.35,100:0.15")
+    parser.add_argument('--speed', type=float, default=1.0)
+    parser.add_argument('--format', help="output format to request (wav, mp3, ...)")
+    parser.add_argument('--replay', help="JSONL request log to replay instead of synthetic traffic")
+    parser.add_argument('--speedup', type=float, default=1.0, help="replay offsets are divided by this")
+    parser.add_argument('--timeout', type=float, default=60.0, help="client timeout per request in seconds")
+    parser.add_argument('--max-in-flight', type=int, default=256,
+                        help="concurrent requests before new arrivals are dropped")
+    parser.add_argument('--random-seed', type=int, default=0, help="seed for arrivals, texts and speakers")
+    parser.add_argument('--output', help="write the summary and per-request results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.duration is None and args.replay is None:
+        args.duration = 60.0
+    if args.replay is None and args.rate <= 0:
+        parser.error("--rate must be positive for synthetic traffic")
+    if args.replay is None and not args.duration and not args.requests:
+        parser.error("synthetic traffic needs --duration or --requests")
+
+    summary, recorder = run(args)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"args": vars(args), "summary": summary, "results": recorder.results}, f, indent=2)
+    return 0 if summary["completed"] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+import os
+import time
+import inspect
+import functools
+import contextlib
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Stages of a generation, in pipeline order
+STAGES = (
+    'queued',          # waiting for an inference worker
+    'coalesced',       # waiting on an identical generation already in flight
+    'split',           # sentence splitting
+    'frontend',        # text normalization, phonemes and BERT features
+    'tts',             # base speaker TTS inference
+    'batch_wait',      # waiting for a conversion micro-batch to start
+    'spectrogram',     # linear spectrogram for the converter
+    'conversion',      # SynthesizerTrn.voice_conversion
+    'watermark',       # wavmark encoding
+    'encode',          # response compression
+    'archive',         # building the /generate-audio/batch zip
+    'response_write',  # sending the body to the client
+)
+
+STAGE_SECONDS = Histogram(
+    'openvoice_stage_seconds',
+    'Time spent in each generation stage',
+    ['stage'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+)
+REQUEST_SECONDS = Histogram(
+    'openvoice_request_seconds',
+    'End-to-end request handling time',
+    ['endpoint'],
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+REQUESTS = Counter(
+    'openvoice_requests_total',
+    'Requests handled, by endpoint and HTTP status',
+    ['endpoint', 'status']
+)
+IN_FLIGHT = Gauge(
+    'openvoice_requests_in_flight',
+    'Requests currently being handled',
+    ['endpoint'],
+    multiprocess_mode='livesum'
+)
+CONVERSION_BATCH_SIZE = Histogram(
+    'openvoice_conversion_batch_size',
+    'Items per micro-batched voice conversion pass',
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+
+
+class StageTimer:
+    """
+    Times pipeline stages into the openvoice_stage_seconds histogram, and
+    keeps this request's own per-stage totals for its Server-Timing header.
+    """
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.durations = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds, observe=True):
+        # observe=False adds to this request's breakdown only, for time already in the histogram
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        if observe:
+            STAGE_SECONDS.labels(name).observe(seconds)
+
+    def record_queued(self):
+        """Record the time since this timer was created as queueing; call when work starts"""
+        self.record('queued', time.perf_counter() - self.created)
+
+    def server_timing(self, audio_seconds=None):
+        """Server-Timing header value: per-stage milliseconds, total, audio duration and real-time factor"""
+        total = time.perf_counter() - self.created
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations.items()]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        if audio_seconds:
+            parts.append(f'audio;desc="{audio_seconds:.2f}s"')
+            parts.append(f'rtf;desc="{total / audio_seconds:.3f}"')
+        return ", ".join(parts)
+
+
+class _RequestTracker:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.status = 500
+
+    def __enter__(self):
+        IN_FLIGHT.labels(self.endpoint).inc()
+        self.start = time.perf_counter()
+        return self
+
+    def done(self, response):
+        # Flask views may return (body, status); everything else carries status_code
+        self.status = response[1] if isinstance(response, tuple) else response.status_code
+        return response
+
+    def __exit__(self, exc_type, exc, tb):
+        IN_FLIGHT.labels(self.endpoint).dec()
+        REQUEST_SECONDS.labels(self.endpoint).observe(time.perf_counter() - self.start)
+        REQUESTS.labels(self.endpoint, str(self.status)).inc()
+        return False
+
+
+def track_request(endpoint):
+    """Decorator counting in-flight requests and timing them per endpoint (sync or async views)"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with _RequestTracker(endpoint) as tracker:
+                    return tracker.done(await fn(*args, **kwargs))
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _RequestTracker(endpoint) as tracker:
+                return tracker.done(fn(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+class _LiveCollector:
+    """Values read at scrape time: queue depths and cache statistics of this process"""
+
+    def __init__(self):
+        self.queues = {}
+        self.caches = {}
+        self.buckets = {}
+
+    def collect(self):
+        depth = GaugeMetricFamily('openvoice_queue_depth', 'Work items waiting to start', labels=['queue'])
+        for name, depth_fn in self.queues.items():
+            depth.add_metric([name], depth_fn())
+        yield depth
+
+        hits = CounterMetricFamily('openvoice_cache_hits', 'Cache hits', labels=['cache', 'tier'])
+        misses = CounterMetricFamily('openvoice_cache_misses', 'Cache misses', labels=['cache'])
+        evictions = CounterMetricFamily('openvoice_cache_evictions', 'Cache evictions', labels=['cache'])
+        hit_rate = GaugeMetricFamily('openvoice_cache_hit_ratio', 'Cache hits over lookups', labels=['cache'])
+        for name, info_fn in self.caches.items():
+            info = info_fn()
+            for key, value in info.items():
+                if key == 'hits' or key.endswith('_hits'):
+                    hits.add_metric([name, key[:-len('_hits')] if key != 'hits' else 'all'], value)
+            misses.add_metric([name], info.get('misses', 0))
+            evictions.add_metric([name], info.get('evictions', 0))
+            hit_rate.add_metric([name], info.get('hit_rate', 0.0))
+        yield hits
+        yield misses
+        yield evictions
+        yield hit_rate
+
+        compiles = CounterMetricFamily('openvoice_compiled_shapes', 'Distinct padded input shapes, one compile each', labels=['graph'])
+        overflows = CounterMetricFamily('openvoice_bucket_overflows', 'Inputs longer than every shape bucket', labels=['graph'])
+        for name, info_fn in self.buckets.items():
+            info = info_fn()
+            compiles.add_metric([name], info['compiles'])
+            overflows.add_metric([name], info['overflows'])
+        yield compiles
+        yield overflows
+
+
+_live = _LiveCollector()
+REGISTRY.register(_live)
+
+
+def track_queue(name, depth_fn):
+    """Export ``depth_fn()`` as openvoice_queue_depth{queue=name}"""
+    _live.queues[name] = depth_fn
+
+
+def track_executor(name, executor):
+    """Export the backlog of a ThreadPoolExecutor"""
+    track_queue(name, lambda: executor._work_queue.qsize())
+
+
+def track_cache(name, info_fn):
+    """Export hits/misses/evictions from a cache's info() dict"""
+    _live.caches[name] = info_fn
+
+
+def track_buckets(name, info_fn):
+    """Export compile and overflow counts from a LengthBuckets' info() dict"""
+    _live.buckets[name] = info_fn
+
+
+def render():
+    """
+    Metrics in the Prometheus text format. Under a multi-process server with
+    PROMETHEUS_MULTIPROC_DIR set, histograms and counters are aggregated over
+    all workers; queue and cache values come from the worker answering.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_live)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,4 +1,5 @@
 import torch
+import torch.nn.functional as F
 import numpy as np
 import re
 import soundfile
@@ -55,12 +56,7 @@ class BaseSpeakerTTS(OpenVoiceBaseClass):
 
     @staticmethod
     def audio_numpy_concat(segment_data_list, sr, speed=1.):
-        audio_segments = []
-        for segment_data in segment_data_list:
-            audio_segments += segment_data.reshape(-1).tolist()
-            audio_segments += [0] * int((sr * 0.05)/speed)
-        audio_segments = np.array(audio_segments).astype(np.float32)
-        return audio_segments
+        return utils.assemble_audio(segment_data_list, silence=int((sr * 0.05)/speed))
 
     @staticmethod
     def split_sentences_into_pieces(text, language_str):
@@ -70,26 +66,76 @@ class BaseSpeakerTTS(OpenVoiceBaseClass):
         print(" > ===========================")
         return texts
 
-    def tts(self, text, output_path, speaker, language='English', speed=1.0):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Summed over every tts() call; see utils.Pipeline
+        self.pipeline_stats = utils.PipelineStats()
+
+    @staticmethod
+    def token_batches(sequences, max_batch_tokens):
+        """
+        Group a stream of (index, token sequence) pairs into consecutive
+        batches whose padded size (items x longest item) stays within
+        ``max_batch_tokens``; a sequence longer than the budget gets a batch
+        of its own. Batches are emitted as soon as they are full, so the
+        text frontend keeps running ahead of inference.
+        """
+        batch, longest = [], 0
+        for index, sequence in sequences:
+            longest_with = max(longest, sequence.size(0))
+            if batch and (len(batch) + 1) * longest_with > max_batch_tokens:
+                yield batch
+                batch, longest_with = [], sequence.size(0)
+            batch.append((index, sequence))
+            longest = longest_with
+        if batch:
+            yield batch
+
+    def tts(self, text, output_path, speaker, language='English', speed=1.0, cancel_token=None, seed=None,
+            max_batch_tokens=1024, queue_size=2):
+        """
+        Synthesize ``text`` sentence by sentence. Text cleaning and
+        text_to_sequence run on a frontend thread, up to ``queue_size``
+        sentences ahead of inference, which takes consecutive sentences in
+        padded batches of up to ``max_batch_tokens`` tokens. With a ``seed``
+        each sentence's noise comes from its own generator (seed + index), so
+        the batching changes the audio only within float tolerance and in each
+        sentence's last few milliseconds (see SynthesizerTrn.infer_batch).
+        """
         mark = self.language_marks.get(language.lower(), None)
         assert mark is not None, f"language {language} is not supported"
 
         texts = self.split_sentences_into_pieces(text, mark)
+        device = self.device
+        speaker_id = self.hps.speakers[speaker]
 
-        audio_list = []
-        for t in texts:
+        def frontend(item):
+            index, t = item
             t = re.sub(r'([a-z])([A-Z])', r'\1 \2', t)
             t = f'[{mark}]{t}[{mark}]'
-            stn_tst = self.get_text(t, self.hps, False)
-            device = self.device
-            speaker_id = self.hps.speakers[speaker]
-            with torch.no_grad():
-                x_tst = stn_tst.unsqueeze(0).to(device)
-                x_tst_lengths = torch.LongTensor([stn_tst.size(0)]).to(device)
-                sid = torch.LongTensor([speaker_id]).to(device)
-                audio = self.model.infer(x_tst, x_tst_lengths, sid=sid, noise_scale=0.667, noise_scale_w=0.6,
-                                    length_scale=1.0 / speed)[0][0, 0].data.cpu().float().numpy()
-            audio_list.append(audio)
+            return index, self.get_text(t, self.hps, False)
+
+        def infer(batch):
+            lengths = [sequence.size(0) for _, sequence in batch]
+            max_len = max(lengths)
+            x_tst = torch.stack([F.pad(sequence, (0, max_len - sequence.size(0))) for _, sequence in batch]).to(device)
+            x_tst_lengths = torch.LongTensor(lengths).to(device)
+            sid = torch.LongTensor([speaker_id] * len(batch)).to(device)
+            generators = None
+            if seed is not None:
+                generators = [torch.Generator().manual_seed(seed + index) for index, _ in batch]
+            outputs = self.model.infer_batch(
+                x_tst, x_tst_lengths, sid=sid, noise_scale=0.667, noise_scale_w=0.6, length_scale=1.0 / speed,
+                generators=generators
+            )
+            return [audio[0, 0].data.cpu().float().numpy() for audio in outputs]
+
+        pipeline = utils.Pipeline([
+            utils.Stage('frontend', frontend),
+            utils.Stage('infer', infer, context=torch.no_grad,
+                        group=lambda sequences: self.token_batches(sequences, max_batch_tokens)),
+        ], queue_size=queue_size, stats=self.pipeline_stats)
+        audio_list = [audio for batch in pipeline.run(enumerate(texts), cancel_token) for audio in batch]
         audio = self.audio_numpy_concat(audio_list, sr=self.hps.data.sampling_rate, speed=speed)
 
         if output_path is None:
@@ -108,7 +154,8 @@ class ToneColorConverter(OpenVoiceBaseClass):
         else:
             self.watermark_model = None
         self.version = getattr(self.hps, '_version_', "v1")
-
+        # utils.LengthBuckets for spectrogram frames; None converts at the exact length
+        self.frame_buckets = None
 
 
     def extract_se(self, ref_wav_list, se_save_path=None):
@@ -120,7 +167,11 @@ class ToneColorConverter(OpenVoiceBaseClass):
         gs = []
         
         for fname in ref_wav_list:
-            audio_ref, sr = librosa.load(fname, sr=hps.data.sampling_rate)
+            if isinstance(fname, np.ndarray):
+                # Samples already at the converter rate
+                audio_ref = fname
+            else:
+                audio_ref, sr = librosa.load(fname, sr=hps.data.sampling_rate)
             y = torch.FloatTensor(audio_ref)
             y = y.to(device)
             y = y.unsqueeze(0)
@@ -138,51 +189,204 @@ class ToneColorConverter(OpenVoiceBaseClass):
 
         return gs
 
-    def convert(self, audio_src_path, src_se, tgt_se, output_path=None, tau=0.3, message="default"):
+    def load_audio(self, audio_src, sample_rate=None):
+        """Return ``audio_src`` as float32 samples at the converter sampling rate.
+
+        ``audio_src`` is either a path on disk or an in-memory numpy array
+        recorded at ``sample_rate`` (defaults to the converter rate).
+        """
+        target_sr = self.hps.data.sampling_rate
+        if isinstance(audio_src, str):
+            audio, _ = librosa.load(audio_src, sr=target_sr)
+            return audio
+        audio = np.asarray(audio_src, dtype=np.float32).reshape(-1)
+        if sample_rate is not None and sample_rate != target_sr:
+            audio = librosa.resample(audio, orig_sr=sample_rate, target_sr=target_sr)
+        return audio
+
+    def posterior_noise(self, frames, seed=None):
+        """
+        Noise for enc_q's reparameterisation, [1, C, frames]. With a seed it
+        comes from a private generator, so it is reproducible no matter what
+        else is using the global RNG; without one it is drawn like randn_like.
+        """
+        shape = (1, self.model.enc_q.out_channels, frames)
+        if seed is None:
+            return torch.randn(shape, device=self.device)
+        generator = torch.Generator().manual_seed(seed)
+        return torch.randn(shape, generator=generator).to(self.device)
+
+    def convert(self, audio_src_path, src_se, tgt_se, output_path=None, tau=0.3, message="default", src_sr=None,
+                cancel_token=None, seed=None, timer=None):
         hps = self.hps
-        # load audio
-        audio, sample_rate = librosa.load(audio_src_path, sr=hps.data.sampling_rate)
-        audio = torch.tensor(audio).float()
+        # load audio, either from disk or from an in-memory buffer
+        audio = self.load_audio(audio_src_path, sample_rate=src_sr)
+        utils.check_cancelled(cancel_token)
         
         with torch.no_grad():
-            y = torch.FloatTensor(audio).to(self.device)
-            y = y.unsqueeze(0)
-            spec = spectrogram_torch(y, hps.data.filter_length,
-                                    hps.data.sampling_rate, hps.data.hop_length, hps.data.win_length,
-                                    center=False).to(self.device)
-            spec_lengths = torch.LongTensor([spec.size(-1)]).to(self.device)
-            audio = self.model.voice_conversion(spec, spec_lengths, sid_src=src_se, sid_tgt=tgt_se, tau=tau)[0][
-                        0, 0].data.cpu().float().numpy()
-            audio = self.add_watermark(audio, message)
+            with utils.stage_timer(timer, 'spectrogram'):
+                spec = self.spectrogram(audio)
+                frames = spec.size(-1)
+                spec_lengths = torch.LongTensor([frames]).to(self.device)
+                spec = self.pad_frames(spec, frames)
+            with utils.stage_timer(timer, 'conversion'):
+                noise = None
+                if seed is not None:
+                    noise = F.pad(self.posterior_noise(frames, seed), (0, spec.size(-1) - frames))
+                # Trimming is a no-op unless the frames were padded to a bucket
+                audio = self.model.voice_conversion(spec, spec_lengths, sid_src=src_se, sid_tgt=tgt_se, tau=tau,
+                                                    noise=noise)[0][0, 0, :frames * hps.data.hop_length]
+                audio = audio.data.cpu().float().numpy()
+            utils.check_cancelled(cancel_token)
+            with utils.stage_timer(timer, 'watermark'):
+                audio = self.add_watermark(audio, message, cancel_token=cancel_token)
             if output_path is None:
                 return audio
             else:
                 soundfile.write(output_path, audio, hps.data.sampling_rate)
     
-    def add_watermark(self, audio, message):
-        if self.watermark_model is None:
+    def convert_batch(self, audio_list, src_se_list, tgt_se_list, tau=0.3, message="default", seeds=None,
+                      timer=None):
+        """
+        Convert several utterances in one batched model pass.
+
+        ``audio_list`` holds float32 samples already at the converter rate.
+        Spectrograms are zero-padded to the longest item and masked through
+        ``spec_lengths``. Posterior noise is drawn per item, in order (or from
+        each item's seed in ``seeds``), as when calling ``convert`` on each
+        item in turn. The decoder runs once over the padded batch (padded to a
+        frame bucket with ``frame_buckets`` set); only the tail of each item
+        differs from converting it alone, which lands in the trailing silence.
+        """
+        if seeds is None:
+            seeds = [None] * len(audio_list)
+        with torch.no_grad():
+            with utils.stage_timer(timer, 'spectrogram'):
+                specs = [self.spectrogram(audio) for audio in audio_list]
+                spec_lengths = torch.LongTensor([spec.size(-1) for spec in specs]).to(self.device)
+                max_len = int(spec_lengths.max())
+                spec = self.pad_frames(
+                    torch.cat([F.pad(s, (0, max_len - s.size(-1))) for s in specs], 0),
+                    max_len
+                )
+                max_len = spec.size(-1)
+
+            with utils.stage_timer(timer, 'conversion'):
+                noise = torch.cat([
+                    F.pad(self.posterior_noise(s.size(-1), seed), (0, max_len - s.size(-1)))
+                    for s, seed in zip(specs, seeds)
+                ], 0)
+
+                sid_src = torch.cat(src_se_list, 0)
+                sid_tgt = torch.cat(tgt_se_list, 0)
+                if self.frame_buckets is not None:
+                    # A single pass at the bucketed shape keeps the compiled graph in use
+                    o_hat = self.model.voice_conversion(spec, spec_lengths, sid_src=sid_src, sid_tgt=sid_tgt,
+                                                        tau=tau, noise=noise)[0]
+                    outputs = [
+                        o_hat[i:i + 1, :, :length * self.hps.data.hop_length]
+                        for i, length in enumerate(spec_lengths.tolist())
+                    ]
+                else:
+                    outputs = self.model.voice_conversion_batch(
+                        spec, spec_lengths,
+                        sid_src=sid_src,
+                        sid_tgt=sid_tgt,
+                        tau=tau, noise=noise
+                    )
+                outputs = [o_hat[0, 0].data.cpu().float().numpy() for o_hat in outputs]
+
+            with utils.stage_timer(timer, 'watermark'):
+                return [self.add_watermark(audio, message) for audio in outputs]
+
+    def pad_frames(self, spec, frames):
+        """Zero-pad a [B, n_freq, frames] spectrogram batch up to its frame bucket, if bucketing is on"""
+        if self.frame_buckets is None:
+            return spec
+        padded = self.frame_buckets(frames)
+        self.frame_buckets.observe((spec.size(0), padded))
+        return F.pad(spec, (0, padded - spec.size(-1)))
+
+    def spectrogram(self, audio):
+        """Linear spectrogram [1, n_freq, frames] of a 1-D float32 buffer"""
+        hps = self.hps
+        y = torch.FloatTensor(audio).to(self.device)
+        y = y.unsqueeze(0)
+        return spectrogram_torch(y, hps.data.filter_length,
+                                 hps.data.sampling_rate, hps.data.hop_length, hps.data.win_length,
+                                 center=False).to(self.device)
+
+    def add_watermark(self, audio, message, cancel_token=None):
+        """Embed ``message`` at the start of ``audio``; a None message leaves it unmarked"""
+        if self.watermark_model is None or message is None:
             return audio
-        device = self.device
         bits = utils.string_to_bits(message).reshape(-1)
         n_repeat = len(bits) // 32
 
         K = 16000
         coeff = 2
         for n in range(n_repeat):
+            utils.check_cancelled(cancel_token)
             trunck = audio[(coeff * n) * K: (coeff * n + 1) * K]
             if len(trunck) != K:
                 print('Audio too short, fail to add watermark')
                 break
-            message_npy = bits[n * 32: (n + 1) * 32]
-            
-            with torch.no_grad():
-                signal = torch.FloatTensor(trunck).to(device)[None]
-                message_tensor = torch.FloatTensor(message_npy).to(device)[None]
-                signal_wmd_tensor = self.watermark_model.encode(signal, message_tensor)
-                signal_wmd_npy = signal_wmd_tensor.detach().cpu().squeeze()
-            audio[(coeff * n) * K: (coeff * n + 1) * K] = signal_wmd_npy
+            audio[(coeff * n) * K: (coeff * n + 1) * K] = self._encode_watermark(trunck, bits[n * 32: (n + 1) * 32])
         return audio
 
+    def _encode_watermark(self, trunck, message_npy):
+        with torch.no_grad():
+            signal = torch.FloatTensor(trunck).to(self.device)[None]
+            message_tensor = torch.FloatTensor(message_npy).to(self.device)[None]
+            signal_wmd_tensor = self.watermark_model.encode(signal, message_tensor)
+            return signal_wmd_tensor.detach().cpu().squeeze()
+
+    def watermark_stream(self, chunks, message, cancel_token=None):
+        """
+        add_watermark over a stream of converted chunks (float32, converter
+        rate): the message lands at the same stream offsets as in one whole
+        buffer, so detect_watermark works on the assembled stream. Only the
+        samples of a watermark window that is not complete yet are held back
+        (all within the first ``3 * 16000`` samples); past the last window,
+        chunks pass straight through.
+        """
+        if self.watermark_model is None or message is None:
+            yield from chunks
+            return
+        bits = utils.string_to_bits(message).reshape(-1)
+        n_repeat = len(bits) // 32
+        K = 16000
+        coeff = 2
+        n = 0  # next window to watermark, at [coeff * n * K, (coeff * n + 1) * K)
+        pending = np.zeros(0, dtype=np.float32)  # samples not yielded yet
+        offset = 0  # stream offset of pending[0]
+        try:
+            for chunk in chunks:
+                pending = np.concatenate([pending, np.asarray(chunk, dtype=np.float32)])
+                while n < n_repeat:
+                    if offset < coeff * n * K and len(pending):
+                        # Samples before the next window are final already
+                        ready = min(coeff * n * K - offset, len(pending))
+                        yield pending[:ready]
+                        pending, offset = pending[ready:], offset + ready
+                    if len(pending) < K or offset < coeff * n * K:
+                        break
+                    utils.check_cancelled(cancel_token)
+                    pending[:K] = self._encode_watermark(pending[:K], bits[n * 32: (n + 1) * 32])
+                    n += 1
+                if n == n_repeat and len(pending):
+                    yield pending
+                    pending, offset = pending[:0], offset + len(pending)
+            if n < n_repeat:
+                print('Audio too short, fail to add watermark')
+            if len(pending):
+                yield pending
+        finally:
+            # Closing this generator stops the stream feeding it too
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
     def detect_watermark(self, audio, n_repeat):
         bits = []
         K = 16000
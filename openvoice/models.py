@@ -132,7 +132,7 @@ class StochasticDurationPredictor(nn.Module):
 		if gin_channels != 0:
 			self.cond = nn.Conv1d(gin_channels, filter_channels, 1)
 
-	def forward(self, x, x_mask, w=None, g=None, reverse=False, noise_scale=1.0):
+	def forward(self, x, x_mask, w=None, g=None, reverse=False, noise_scale=1.0, noise=None):
 		x = torch.detach(x)
 		x = self.pre(x)
 		if g is not None:
@@ -172,7 +172,9 @@ class StochasticDurationPredictor(nn.Module):
 		else:
 			flows = list(reversed(self.flows))
 			flows = flows[:-2] + [flows[-1]] # remove a useless vflow
-			z = torch.randn(x.size(0), 2, x.size(2)).to(device=x.device, dtype=x.dtype) * noise_scale
+			if noise is None:
+				noise = torch.randn(x.size(0), 2, x.size(2))
+			z = noise.to(device=x.device, dtype=x.dtype) * noise_scale
 			for flow in flows:
 				z = flow(z, x_mask, g=x, reverse=reverse)
 			z0, z1 = torch.split(z, [1, 1], 1)
@@ -209,7 +211,7 @@ class PosteriorEncoder(nn.Module):
         )
         self.proj = nn.Conv1d(hidden_channels, out_channels * 2, 1)
 
-    def forward(self, x, x_lengths, g=None, tau=1.0):
+    def forward(self, x, x_lengths, g=None, tau=1.0, noise=None):
         x_mask = torch.unsqueeze(commons.sequence_mask(x_lengths, x.size(2)), 1).to(
             x.dtype
         )
@@ -217,7 +219,9 @@ class PosteriorEncoder(nn.Module):
         x = self.enc(x, x_mask, g=g)
         stats = self.proj(x) * x_mask
         m, logs = torch.split(stats, self.out_channels, dim=1)
-        z = (m + torch.randn_like(m) * tau * torch.exp(logs)) * x_mask
+        if noise is None:
+            noise = torch.randn_like(m)
+        z = (m + noise * tau * torch.exp(logs)) * x_mask
         return z, m, logs, x_mask
 
 
@@ -489,11 +493,92 @@ class SynthesizerTrn(nn.Module):
         o = self.dec((z * y_mask)[:,:,:max_len], g=g)
         return o, attn, y_mask, (z, z_p, m_p, logs_p)
 
-    def voice_conversion(self, y, y_lengths, sid_src, sid_tgt, tau=1.0):
+    @staticmethod
+    def _batch_noise(channels, lengths, total, generators, like):
+        """
+        Standard normal noise [b, channels, total]. With one generator per item,
+        item i's noise is drawn from its own generator over its own length and
+        zero-padded, so it does not depend on what it is batched with.
+        """
+        if generators is None:
+            return torch.randn(len(lengths), channels, total, device=like.device, dtype=like.dtype)
+        return torch.cat([
+            F.pad(torch.randn((1, channels, length), generator=generator), (0, total - length))
+            for length, generator in zip(lengths, generators)
+        ]).to(device=like.device, dtype=like.dtype)
+
+    def infer_batch(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., sdp_ratio=0.2,
+                    generators=None):
+        """
+        infer over zero-padded token sequences.
+
+        The text encoder, duration predictors and flow are masked with
+        x_lengths / y_mask, so padding never leaks into them. The decoder has
+        no mask: it runs once on the whole masked batch and each item is
+        trimmed to ``y_length * hop`` samples, as in voice_conversion_batch,
+        so an item's last few milliseconds can differ slightly from decoding
+        it alone. With ``generators`` (one CPU torch.Generator per item) every
+        item draws its own noise, so a seeded item does not depend on what it
+        is batched with, up to float tolerance (batched kernels are not
+        bitwise stable across batch sizes).
+        Returns a list with one [1, 1, t] waveform per item.
+        """
+        x, m_p, logs_p, x_mask = self.enc_p(x, x_lengths)
+        if self.n_speakers > 0:
+            g = self.emb_g(sid).unsqueeze(-1) # [b, h, 1]
+        else:
+            g = None
+
+        noise_w = self._batch_noise(2, x_lengths.tolist(), x.size(2), generators, x)
+        logw = self.sdp(x, x_mask, g=g, reverse=True, noise_scale=noise_scale_w, noise=noise_w) * sdp_ratio \
+            + self.dp(x, x_mask, g=g) * (1 - sdp_ratio)
+
+        w = torch.exp(logw) * x_mask * length_scale
+        w_ceil = torch.ceil(w)
+        y_lengths = torch.clamp_min(torch.sum(w_ceil, [1, 2]), 1).long()
+        y_mask = torch.unsqueeze(commons.sequence_mask(y_lengths, None), 1).to(x_mask.dtype)
+        attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
+        attn = commons.generate_path(w_ceil, attn_mask)
+
+        m_p = torch.matmul(attn.squeeze(1), m_p.transpose(1, 2)).transpose(1, 2) # [b, t', t], [b, t, d] -> [b, d, t']
+        logs_p = torch.matmul(attn.squeeze(1), logs_p.transpose(1, 2)).transpose(1, 2) # [b, t', t], [b, t, d] -> [b, d, t']
+
+        lengths = y_lengths.tolist()
+        noise = self._batch_noise(m_p.size(1), lengths, m_p.size(2), generators, m_p)
+        z_p = m_p + noise * torch.exp(logs_p) * noise_scale
+        z = self.flow(z_p, y_mask, g=g, reverse=True) * y_mask
+        o = self.dec(z, g=g)
+        hop = o.size(-1) // z.size(-1)
+        return [o[i:i + 1, :, :length * hop] for i, length in enumerate(lengths)]
+
+    def voice_conversion(self, y, y_lengths, sid_src, sid_tgt, tau=1.0, noise=None):
         g_src = sid_src
         g_tgt = sid_tgt
-        z, m_q, logs_q, y_mask = self.enc_q(y, y_lengths, g=g_src if not self.zero_g else torch.zeros_like(g_src), tau=tau)
+        z, m_q, logs_q, y_mask = self.enc_q(y, y_lengths, g=g_src if not self.zero_g else torch.zeros_like(g_src), tau=tau, noise=noise)
         z_p = self.flow(z, y_mask, g=g_src)
         z_hat = self.flow(z_p, y_mask, g=g_tgt, reverse=True)
         o_hat = self.dec(z_hat * y_mask, g=g_tgt if not self.zero_g else torch.zeros_like(g_tgt))
         return o_hat, y_mask, (z, z_p, z_hat)
+
+    def voice_conversion_batch(self, y, y_lengths, sid_src, sid_tgt, tau=1.0, noise=None):
+        """
+        Batched voice_conversion over zero-padded spectrograms.
+
+        enc_q and the flows are masked with y_lengths, so padding never leaks
+        into them. The decoder has no mask: it runs once on the whole masked
+        batch and each item is trimmed to ``length * hop`` samples. Unlike
+        decoding an item alone, its last frames then see the zeroed latents
+        of the padding through the decoder's receptive field rather than the
+        convolutions' own zero padding, so the final few milliseconds (the
+        trailing silence) can differ slightly; the rest matches to float
+        tolerance.
+        Returns a list with one [1, 1, t] waveform per item.
+        """
+        g_src = sid_src
+        g_tgt = sid_tgt
+        z, m_q, logs_q, y_mask = self.enc_q(y, y_lengths, g=g_src if not self.zero_g else torch.zeros_like(g_src), tau=tau, noise=noise)
+        z_p = self.flow(z, y_mask, g=g_src)
+        z_hat = self.flow(z_p, y_mask, g=g_tgt, reverse=True) * y_mask
+        o_hat = self.dec(z_hat, g=g_tgt if not self.zero_g else torch.zeros_like(g_tgt))
+        hop = o_hat.size(-1) // z_hat.size(-1)
+        return [o_hat[i:i + 1, :, :length * hop] for i, length in enumerate(y_lengths.tolist())]
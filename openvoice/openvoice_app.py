@@ -19,17 +19,19 @@ output_dir = 'outputs'
 os.makedirs(output_dir, exist_ok=True)
 
 # load models
-en_base_speaker_tts = BaseSpeakerTTS(f'{en_ckpt_base}/config.json', device=device)
-en_base_speaker_tts.load_ckpt(f'{en_ckpt_base}/checkpoint.pth')
-zh_base_speaker_tts = BaseSpeakerTTS(f'{zh_ckpt_base}/config.json', device=device)
-zh_base_speaker_tts.load_ckpt(f'{zh_ckpt_base}/checkpoint.pth')
 tone_color_converter = ToneColorConverter(f'{ckpt_converter}/config.json', device=device)
 tone_color_converter.load_ckpt(f'{ckpt_converter}/checkpoint.pth')
 
-# load speaker embeddings
-en_source_default_se = torch.load(f'{en_ckpt_base}/en_default_se.pth').to(device)
-en_source_style_se = torch.load(f'{en_ckpt_base}/en_style_se.pth').to(device)
-zh_source_se = torch.load(f'{zh_ckpt_base}/zh_default_se.pth').to(device)
+# Base speakers and their embeddings are loaded on first use, so an English-only session never loads Chinese
+base_speakers = {}
+
+def get_base_speaker(ckpt_base, se_names):
+    if ckpt_base not in base_speakers:
+        tts_model = BaseSpeakerTTS(f'{ckpt_base}/config.json', device=device)
+        tts_model.load_ckpt(f'{ckpt_base}/checkpoint.pth')
+        ses = {name: torch.load(f'{ckpt_base}/{name}.pth').to(device) for name in se_names}
+        base_speakers[ckpt_base] = (tts_model, ses)
+    return base_speakers[ckpt_base]
 
 # This online demo mainly supports English and Chinese
 supported_languages = ['zh', 'en']
@@ -64,8 +66,8 @@ def predict(prompt, style, audio_file_pth, agree):
         )
     
     if language_predicted == "zh":
-        tts_model = zh_base_speaker_tts
-        source_se = zh_source_se
+        tts_model, ses = get_base_speaker(zh_ckpt_base, ['zh_default_se'])
+        source_se = ses['zh_default_se']
         language = 'Chinese'
         if style not in ['default']:
             text_hint += f"[ERROR] The style {style} is not supported for Chinese, which should be in ['default']\n"
@@ -77,11 +79,11 @@ def predict(prompt, style, audio_file_pth, agree):
             )
 
     else:
-        tts_model = en_base_speaker_tts
+        tts_model, ses = get_base_speaker(en_ckpt_base, ['en_default_se', 'en_style_se'])
         if style == 'default':
-            source_se = en_source_default_se
+            source_se = ses['en_default_se']
         else:
-            source_se = en_source_style_se
+            source_se = ses['en_style_se']
         language = 'English'
         if style not in ['default', 'whispering', 'shouting', 'excited', 'cheerful', 'terrified', 'angry', 'sad', 'friendly']:
             text_hint += f"[ERROR] The style {style} is not supported for English, which should be in ['default', 'whispering', 'shouting', 'excited', 'cheerful', 'terrified', 'angry', 'sad', 'friendly']\n"
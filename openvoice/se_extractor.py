@@ -12,6 +12,7 @@ import hashlib
 import base64
 import librosa
 from whisper_timestamped.transcribe import get_audio_tensor, get_vad_segments
+from openvoice.utils import SingleFlight
 
 model_size = "medium"
 # Run on GPU with FP16
@@ -126,13 +127,24 @@ def hash_numpy_array(audio_path):
     base64_value = base64.b64encode(hash_value)
     return base64_value.decode('utf-8')[:16].replace('/', '_^')
 
+# Concurrent first-time extractions of the same audio share one run
+se_flights = SingleFlight()
+
+
 def get_se(audio_path, vc_model, target_dir='processed', vad=True):
-    device = vc_model.device
     version = vc_model.version
     print("OpenVoice version:", version)
 
     audio_name = f"{os.path.basename(audio_path).rsplit('.', 1)[0]}_{version}_{hash_numpy_array(audio_path)}"
     se_path = os.path.join(target_dir, audio_name, 'se.pth')
+    return se_flights.do(
+        (se_path, vad, id(vc_model)),
+        lambda _: _get_se(audio_path, vc_model, target_dir, vad, audio_name, se_path)
+    )
+
+
+def _get_se(audio_path, vc_model, target_dir, vad, audio_name, se_path):
+    device = vc_model.device
 
     # if os.path.isfile(se_path):
     #     se = torch.load(se_path).to(device)
@@ -151,3 +163,40 @@ def get_se(audio_path, vc_model, target_dir='processed', vad=True):
     
     return vc_model.extract_se(audio_segs, se_save_path=se_path), audio_name
 
+
+def split_array_vad(audio, sample_rate, split_seconds=10.0):
+    """
+    split_audio_vad on an in-memory mono float32 array: VAD runs on a 16 kHz
+    copy, and the voiced samples are cut from ``audio`` and split into chunks
+    of about ``split_seconds``, without writing any segment files.
+    """
+    SAMPLE_RATE = 16000
+    audio_vad = torch.from_numpy(
+        librosa.resample(np.asarray(audio, dtype=np.float32), orig_sr=sample_rate, target_sr=SAMPLE_RATE)
+    )
+    segments = get_vad_segments(
+        audio_vad,
+        output_sample=True,
+        min_speech_duration=0.1,
+        min_silence_duration=1,
+        method="silero",
+    )
+    scale = sample_rate / SAMPLE_RATE
+    active = [audio[int(seg["start"] * scale): int(seg["end"] * scale)] for seg in segments]
+    audio_active = np.concatenate(active) if active else np.zeros(0, dtype=np.float32)
+
+    audio_dur = len(audio_active) / sample_rate
+    print(f'after vad: dur = {audio_dur}')
+    num_splits = int(np.round(audio_dur / split_seconds))
+    assert num_splits > 0, 'input audio is too short'
+    return [np.ascontiguousarray(chunk) for chunk in np.array_split(audio_active, num_splits)]
+
+
+def get_se_from_array(audio, sample_rate, vc_model):
+    """
+    get_se for a voice already decoded to mono float32 samples at the
+    converter's rate (e.g. a memory-mapped PCM copy): VAD, split and
+    extract_se all work on the samples directly.
+    """
+    assert sample_rate == vc_model.hps.data.sampling_rate, 'samples must be at the converter rate'
+    return vc_model.extract_se(split_array_vad(audio, sample_rate))
@@ -1,8 +1,323 @@
 import re
 import json
+import time
+import queue
+import threading
+import contextlib
+from collections import namedtuple
 import numpy as np
 
 
+class GenerationCancelled(Exception):
+    """Raised inside a pipeline when its CancellationToken has been cancelled"""
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation flag shared between a caller and a running job.
+    The job calls raise_if_cancelled() between stages; the caller calls cancel().
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Run ``callback`` when the token is cancelled (immediately if it already is)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise GenerationCancelled()
+
+
+def check_cancelled(cancel_token):
+    """raise_if_cancelled() that tolerates a missing token"""
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+
+class LengthBuckets:
+    """
+    Rounds variable sequence lengths up to a fixed set of sizes, so graphs
+    compiled for static shapes are reused instead of recompiled per length.
+
+    ``observe(shape)`` counts every padded shape seen for the first time,
+    which under torch.compile(dynamic=False) is one compile. Lengths above
+    the largest bucket are padded to a multiple of it and counted as
+    overflows, with a warning, since each of those compiles a new graph.
+    """
+
+    def __init__(self, sizes, name="input"):
+        self.sizes = sorted(int(size) for size in sizes)
+        self.name = name
+        self._seen = set()
+        self._lock = threading.Lock()
+        self.stats = {"compiles": 0, "overflows": 0}
+
+    def __call__(self, length):
+        for size in self.sizes:
+            if length <= size:
+                return size
+        largest = self.sizes[-1]
+        padded = -(-length // largest) * largest
+        with self._lock:
+            self.stats["overflows"] += 1
+        print(f"Warning: {self.name} length {length} is outside every bucket "
+              f"(largest {largest}); padding to {padded}")
+        return padded
+
+    def observe(self, shape):
+        """Note a padded input shape; returns True the first time it is seen"""
+        with self._lock:
+            if shape in self._seen:
+                return False
+            self._seen.add(shape)
+            self.stats["compiles"] += 1
+            count = self.stats["compiles"]
+        print(f"Compiling {self.name} graph for shape {shape} ({count} so far)")
+        return True
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, buckets=list(self.sizes), shapes=len(self._seen))
+
+
+class _Flight:
+    def __init__(self):
+        self.token = CancellationToken()
+        self.waiters = 0
+        self.wakeups = []
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs
+    ``fn(cancel_token)`` and everyone who asks for the same key meanwhile
+    waits for that one result (or exception). The shared token is cancelled
+    only once every waiter's own ``cancel_token`` has been cancelled, and a
+    cancelled waiter stops waiting right away.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    def do(self, key, fn, cancel_token=None):
+        wakeup = threading.Event()
+        with self._lock:
+            self.stats["calls"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.stats["coalesced"] += 1
+            flight.waiters += 1
+            flight.wakeups.append(wakeup)
+        if cancel_token is not None:
+            cancel_token.on_cancel(lambda: self._leave(flight, wakeup))
+
+        if leader:
+            try:
+                result, error = fn(flight.token), None
+            except BaseException as e:
+                result, error = None, e
+            with self._lock:
+                # Later calls start a new flight rather than joining a finished one
+                del self._flights[key]
+                flight.done = True
+                flight.result, flight.error = result, error
+                wakeups = flight.wakeups
+            for event in wakeups:
+                event.set()
+        else:
+            wakeup.wait()
+
+        with self._lock:
+            done = flight.done
+        if not done or (cancel_token is not None and cancel_token.cancelled):
+            raise GenerationCancelled()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _leave(self, flight, wakeup):
+        with self._lock:
+            if flight.done:
+                return
+            flight.waiters -= 1
+            last = flight.waiters == 0
+        wakeup.set()
+        if last:
+            flight.token.cancel()
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._flights))
+
+
+# One step of a Pipeline: ``fn(item)`` runs inside ``context()`` (entered once, on the
+# stage's own thread) and ``item_context()`` (entered around every item); ``group(items)``,
+# if given, regroups the upstream items first
+Stage = namedtuple('Stage', ['name', 'fn', 'context', 'group', 'item_context'], defaults=[None, None, None])
+
+
+class PipelineStats:
+    """Per-stage item counts, busy time and utilization, summed over every Pipeline run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, name, items, busy, active):
+        with self._lock:
+            stats = self._stages.setdefault(name, {"items": 0, "busy_seconds": 0.0, "active_seconds": 0.0})
+            stats["items"] += items
+            stats["busy_seconds"] += busy
+            stats["active_seconds"] += active
+
+    def info(self):
+        """Utilization is the share of a stage thread's lifetime spent working rather than waiting"""
+        with self._lock:
+            return {
+                name: dict(stats, utilization=stats["busy_seconds"] / stats["active_seconds"]
+                           if stats["active_seconds"] else 0.0)
+                for name, stats in self._stages.items()
+            }
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages, each on its own thread and joined
+    by queues of at most ``queue_size`` items, so stage k works on item n
+    while stage k+1 is still on item n-1. Results come out in input order;
+    the first exception from any stage is raised to the consumer.
+    """
+
+    _POLL = 0.1
+
+    def __init__(self, stages, queue_size=2, stats=None):
+        self.stages = [Stage(*stage) for stage in stages]
+        self.queue_size = queue_size
+        self.stats = stats
+
+    def run(self, items, cancel_token=None):
+        """Generator of the last stage's results; closing it stops the stages after their current item"""
+        stop = threading.Event()
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+
+        def put(q, entry):
+            while not stop.is_set():
+                try:
+                    q.put(entry, timeout=self._POLL)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def drain(q):
+            while not stop.is_set():
+                try:
+                    done, value = q.get(timeout=self._POLL)
+                except queue.Empty:
+                    continue
+                if done:
+                    if value is not None:
+                        raise value
+                    return
+                yield value
+
+        def work(stage, inbox, outbox):
+            started = time.perf_counter()
+            busy = 0.0
+            count = 0
+            try:
+                with stage.context() if stage.context is not None else contextlib.nullcontext():
+                    for item in stage.group(inbox) if stage.group is not None else inbox:
+                        check_cancelled(cancel_token)
+                        start = time.perf_counter()
+                        with stage.item_context() if stage.item_context is not None else contextlib.nullcontext():
+                            result = stage.fn(item)
+                        busy += time.perf_counter() - start
+                        count += 1
+                        if not put(outbox, (False, result)):
+                            return
+                put(outbox, (True, None))
+            except BaseException as e:
+                put(outbox, (True, e))
+            finally:
+                if self.stats is not None:
+                    self.stats.record(stage.name, count, busy, time.perf_counter() - started)
+
+        threads = []
+        inbox = iter(items)
+        for stage, outbox in zip(self.stages, queues):
+            threads.append(threading.Thread(target=work, args=(stage, inbox, outbox),
+                                            name=f"pipeline-{stage.name}", daemon=True))
+            inbox = drain(outbox)
+        for thread in threads:
+            thread.start()
+        try:
+            yield from inbox
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+
+def stage_timer(timer, name):
+    """``timer.stage(name)`` for an optional timer object exposing a stage() context manager"""
+    if timer is None:
+        return contextlib.nullcontext()
+    return timer.stage(name)
+
+
+def assemble_audio(segments, silence=0, crossfade=0):
+    """
+    Join 1-D audio segments into one float32 array allocated once at its final
+    length, with ``silence`` zero samples after each segment. Without
+    silence, ``crossfade`` > 0 overlaps adjacent segments by that many samples
+    with a linear fade instead of butting them together.
+    """
+    segments = [np.asarray(segment, dtype=np.float32).reshape(-1) for segment in segments]
+    fade = crossfade if not silence else 0
+    overlaps = [0] + [min(fade, len(a), len(b)) for a, b in zip(segments, segments[1:])]
+    total = sum(len(segment) for segment in segments) + silence * len(segments) - sum(overlaps)
+    audio = np.zeros(total, dtype=np.float32)
+    pos = 0
+    for segment, overlap in zip(segments, overlaps):
+        if overlap:
+            ramp = np.linspace(0, 1, overlap + 2, dtype=np.float32)[1:-1]
+            audio[pos - overlap:pos] *= 1 - ramp
+            audio[pos - overlap:pos] += segment[:overlap] * ramp
+        audio[pos:pos + len(segment) - overlap] = segment[overlap:]
+        pos += len(segment) - overlap + silence
+    return audio
+
+
 def get_hparams_from_file(config_path):
     with open(config_path, "r", encoding="utf-8") as f:
         data = f.read()
@@ -0,0 +1,33 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+api = pytest.importorskip("openvoice.api")
+
+
+def batches(lengths, max_batch_tokens):
+    sequences = ((index, torch.zeros(length, dtype=torch.long)) for index, length in enumerate(lengths))
+    return [
+        [(index, sequence.size(0)) for index, sequence in batch]
+        for batch in api.BaseSpeakerTTS.token_batches(sequences, max_batch_tokens)
+    ]
+
+
+def test_batches_stay_within_the_padded_token_budget():
+    result = batches([3, 4, 2, 5, 1], max_batch_tokens=10)
+    assert result == [[(0, 3), (1, 4)], [(2, 2), (3, 5)], [(4, 1)]]
+    for batch in result:
+        assert len(batch) * max(length for _, length in batch) <= 10
+
+
+def test_long_sequence_gets_a_batch_of_its_own():
+    assert batches([2, 20, 2], max_batch_tokens=8) == [[(0, 2)], [(1, 20)], [(2, 2)]]
+
+
+def test_order_and_indices_are_kept():
+    result = batches([1] * 7, max_batch_tokens=3)
+    assert [index for batch in result for index, _ in batch] == list(range(7))
+    assert [len(batch) for batch in result] == [3, 3, 1]
+
+
+def test_empty_input():
+    assert batches([], max_batch_tokens=8) == []
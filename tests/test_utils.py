@@ -0,0 +1,265 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from openvoice.utils import (
+    CancellationToken,
+    GenerationCancelled,
+    Pipeline,
+    PipelineStats,
+    SingleFlight,
+    Stage,
+    assemble_audio,
+)
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for condition"
+        time.sleep(0.005)
+
+
+def _start(target, *args):
+    """Run ``target(*args)`` on a thread; returns (thread, outcome dict with 'result' or 'error')"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = target(*args)
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, outcome
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_one_execution(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn(token):
+            calls.append(token)
+            release.wait(5)
+            return 'audio'
+
+        leader, leader_outcome = _start(flights.do, 'key', fn)
+        _wait_for(lambda: calls)
+        follower, follower_outcome = _start(flights.do, 'key', fn)
+        _wait_for(lambda: flights.info()["coalesced"] == 1)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        assert len(calls) == 1
+        assert leader_outcome == {'result': 'audio'}
+        assert follower_outcome == {'result': 'audio'}
+        assert flights.info() == {"calls": 2, "coalesced": 1, "in_flight": 0}
+
+    def test_finished_flight_is_not_joined(self):
+        flights = SingleFlight()
+        assert flights.do('key', lambda token: 1) == 1
+        assert flights.do('key', lambda token: 2) == 2
+        assert flights.info()["coalesced"] == 0
+
+    def test_error_is_forwarded_to_every_waiter(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        started = threading.Event()
+
+        def fn(token):
+            started.set()
+            release.wait(5)
+            raise ValueError('bad voice')
+
+        leader, leader_outcome = _start(flights.do, 'key', fn)
+        started.wait(5)
+        follower, follower_outcome = _start(flights.do, 'key', fn)
+        _wait_for(lambda: flights.info()["coalesced"] == 1)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        assert isinstance(leader_outcome['error'], ValueError)
+        assert isinstance(follower_outcome['error'], ValueError)
+
+    def test_follower_survives_leader_cancel(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        tokens = []
+
+        def fn(token):
+            tokens.append(token)
+            release.wait(5)
+            return 'audio'
+
+        leader_token = CancellationToken()
+        leader, leader_outcome = _start(flights.do, 'key', fn, leader_token)
+        _wait_for(lambda: tokens)
+        follower, follower_outcome = _start(flights.do, 'key', fn, CancellationToken())
+        _wait_for(lambda: flights.info()["coalesced"] == 1)
+
+        leader_token.cancel()
+        # Someone still wants the result, so the shared work goes on
+        assert not tokens[0].cancelled
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        assert isinstance(leader_outcome['error'], GenerationCancelled)
+        assert follower_outcome == {'result': 'audio'}
+
+    def test_shared_token_cancelled_once_every_waiter_left(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        tokens = []
+
+        def fn(token):
+            tokens.append(token)
+            release.wait(5)
+            return 'audio'
+
+        first, second = CancellationToken(), CancellationToken()
+        leader, leader_outcome = _start(flights.do, 'key', fn, first)
+        _wait_for(lambda: tokens)
+        follower, follower_outcome = _start(flights.do, 'key', fn, second)
+        _wait_for(lambda: flights.info()["coalesced"] == 1)
+
+        second.cancel()
+        follower.join(5)
+        assert isinstance(follower_outcome['error'], GenerationCancelled)
+        assert not tokens[0].cancelled
+        first.cancel()
+        assert tokens[0].cancelled
+        release.set()
+        leader.join(5)
+        assert isinstance(leader_outcome['error'], GenerationCancelled)
+
+
+class TestPipeline:
+    def test_results_come_out_in_input_order(self):
+        def slow_on_even(x):
+            time.sleep(0.01 if x % 2 == 0 else 0)
+            return x
+
+        pipeline = Pipeline([
+            Stage('double', lambda x: x * 2),
+            Stage('slow', slow_on_even),
+            Stage('str', str),
+        ], queue_size=1)
+        assert list(pipeline.run(range(10))) == [str(x * 2) for x in range(10)]
+
+    def test_stage_error_is_raised_to_the_consumer(self):
+        def fail_on_three(x):
+            if x == 3:
+                raise ValueError('sentence 3')
+            return x
+
+        pipeline = Pipeline([Stage('a', lambda x: x), Stage('b', fail_on_three)])
+        results = []
+        with pytest.raises(ValueError, match='sentence 3'):
+            for result in pipeline.run(range(10)):
+                results.append(result)
+        assert results == [0, 1, 2]
+
+    def test_closing_early_stops_the_stages(self):
+        processed = []
+
+        def endless():
+            n = 0
+            while True:
+                yield n
+                n += 1
+
+        def record(x):
+            processed.append(x)
+            return x
+
+        results = Pipeline([Stage('record', record)], queue_size=1).run(endless())
+        assert next(results) == 0
+        results.close()
+        count = len(processed)
+        time.sleep(0.05)
+        assert len(processed) == count
+        assert not any(thread.name.startswith('pipeline-') for thread in threading.enumerate())
+
+    def test_cancellation_stops_the_run(self):
+        token = CancellationToken()
+
+        def cancel_at_two(x):
+            if x == 2:
+                token.cancel()
+            return x
+
+        pipeline = Pipeline([Stage('a', cancel_at_two), Stage('b', lambda x: x)])
+        with pytest.raises(GenerationCancelled):
+            list(pipeline.run(range(100), token))
+
+    def test_contexts_and_grouping(self):
+        events = []
+
+        class Context:
+            def __init__(self, name):
+                self.name = name
+
+            def __enter__(self):
+                events.append(f'enter {self.name}')
+
+            def __exit__(self, *exc):
+                events.append(f'exit {self.name}')
+
+        def pairs(items):
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) == 2:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        pipeline = Pipeline([
+            Stage('sum', sum, lambda: Context('run'), pairs, lambda: Context('item')),
+        ])
+        assert list(pipeline.run(range(5))) == [1, 5, 4]
+        assert events == ['enter run'] + ['enter item', 'exit item'] * 3 + ['exit run']
+
+    def test_stats_count_items_per_stage(self):
+        stats = PipelineStats()
+        pipeline = Pipeline([Stage('a', lambda x: x), Stage('b', lambda x: x)], stats=stats)
+        list(pipeline.run(range(4)))
+        list(pipeline.run(range(3)))
+        info = stats.info()
+        assert info['a']['items'] == 7
+        assert info['b']['items'] == 7
+        assert 0.0 <= info['a']['utilization'] <= 1.0
+
+
+class TestAssembleAudio:
+    def test_silence_after_each_segment(self):
+        audio = assemble_audio([[1, 1], [2, 2, 2]], silence=2)
+        assert audio.dtype == np.float32
+        np.testing.assert_array_equal(audio, [1, 1, 0, 0, 2, 2, 2, 0, 0])
+
+    def test_plain_concatenation(self):
+        np.testing.assert_array_equal(assemble_audio([[1], [2, 3]]), [1, 2, 3])
+
+    def test_crossfade_overlaps_adjacent_segments(self):
+        audio = assemble_audio([np.ones(4), np.zeros(4)], crossfade=2)
+        assert len(audio) == 6
+        np.testing.assert_allclose(audio, [1, 1, 2 / 3, 1 / 3, 0, 0], rtol=1e-6)
+
+    def test_crossfade_is_ignored_with_silence(self):
+        audio = assemble_audio([np.ones(4), np.ones(4)], silence=1, crossfade=2)
+        assert len(audio) == 10
+
+    def test_crossfade_is_capped_by_short_segments(self):
+        assert len(assemble_audio([np.ones(1), np.ones(4)], crossfade=3)) == 4
+
+    def test_empty(self):
+        assert len(assemble_audio([])) == 0
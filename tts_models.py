@@ -0,0 +1,195 @@
+import gc
+import re
+import sys
+import time
+import threading
+import contextlib
+from collections import OrderedDict
+import torch
+from melo.api import TTS
+
+# MeloTTS speaker each language is synthesized with; languages not listed use their first speaker
+DEFAULT_SPEAKERS = {'EN': 'EN-US'}
+
+# melo.text modules that keep each language's BERT frontend in module globals once it is first used
+BERT_MODULES = {
+    'EN': 'english_bert', 'ZH': 'chinese_bert', 'ZH_MIX_EN': 'chinese_bert', 'JP': 'japanese_bert',
+    'FR': 'french_bert', 'SP': 'spanish_bert', 'ES': 'spanish_bert', 'KR': 'korean',
+}
+
+# Scripts that identify a language on their own; Latin text falls back to the default language
+SCRIPT_LANGUAGES = [
+    (re.compile(r'[぀-ヿ]'), 'JP'),  # hiragana, katakana
+    (re.compile(r'[가-힯ᄀ-ᇿ]'), 'KR'),  # hangul
+    (re.compile(r'[一-鿿]'), 'ZH'),  # CJK ideographs without kana
+]
+
+
+def _module_bytes(module):
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+def bert_models(language):
+    """The BERT models melo has loaded for ``language``'s text frontend, as found in its module cache"""
+    module = sys.modules.get(f"melo.text.{BERT_MODULES.get(language)}")
+    if module is None:
+        return []
+    found = [module.model] if isinstance(getattr(module, 'model', None), torch.nn.Module) else []
+    models = getattr(module, 'models', None)
+    if isinstance(models, dict):
+        found.extend(model for model in models.values() if isinstance(model, torch.nn.Module))
+    return found
+
+
+def release_bert(language):
+    """Drop melo's cached BERT models for ``language``; melo loads them again on next use"""
+    module = sys.modules.get(f"melo.text.{BERT_MODULES.get(language)}")
+    if module is None:
+        return
+    if getattr(module, 'model', None) is not None:
+        module.model = None
+    if isinstance(getattr(module, 'models', None), dict):
+        module.models.clear()
+
+
+def detect_language(text, default='EN'):
+    """Language of ``text`` from the script it is written in; cheap enough to run per request"""
+    for pattern, language in SCRIPT_LANGUAGES:
+        if pattern.search(text):
+            return language
+    return default
+
+
+class LanguageModel:
+    """A loaded MeloTTS base model with the speaker and source embedding it converts from"""
+
+    def __init__(self, language, tts, speaker, speaker_id, source_se):
+        self.language = language
+        self.tts = tts
+        self.speaker = speaker
+        self.speaker_id = speaker_id
+        # Tone color of the base speaker, e.g. checkpoints_v2/base_speakers/ses/en-us.pth
+        self.speaker_key = speaker.lower().replace('_', '-')
+        self.source_se = source_se
+        self.sampling_rate = tts.hps.data.sampling_rate
+        # The synthesizer only; the BERT frontend lives in melo's module globals, see bert_models()
+        self.synth_bytes = _module_bytes(tts.model)
+        self.last_used = time.monotonic()
+        self.users = 0
+
+
+class TTSModelRegistry:
+    """
+    Base TTS models by language, loaded on first use.
+
+    Loaded models are kept under ``memory_budget`` bytes of weights (the
+    synthesizers plus the BERT frontends melo has loaded for them) by
+    unloading the least recently used ones that no request is using, BERT
+    included; the ``pinned`` languages stay loaded. ``prepare(tts)``, if given, is applied
+    to every freshly loaded model (e.g. to compile it).
+    """
+
+    def __init__(self, device, languages, memory_budget=0, pinned=(), ses_folder='checkpoints_v2/base_speakers/ses',
+                 prepare=None):
+        self.device = device
+        self.languages = [language.upper() for language in languages]
+        self.memory_budget = memory_budget
+        self.pinned = {language.upper() for language in pinned}
+        self.ses_folder = ses_folder
+        self.prepare = prepare
+        self._lock = threading.Lock()
+        self._load_locks = {language: threading.Lock() for language in self.languages}
+        self._models = OrderedDict()
+        self.stats = {"loads": 0, "evictions": 0}
+
+    def _load(self, language):
+        start_time = time.time()
+        tts = TTS(language=language, device=self.device)
+        spk2id = tts.hps.data.spk2id
+        speaker = DEFAULT_SPEAKERS.get(language, next(iter(spk2id)))
+        source_se = torch.load(
+            f"{self.ses_folder}/{speaker.lower().replace('_', '-')}.pth",
+            map_location=self.device
+        )
+        if self.prepare is not None:
+            self.prepare(tts)
+        print(f"Loaded {language} base TTS in {time.time() - start_time:.2f} seconds")
+        return LanguageModel(language, tts, speaker, spk2id[speaker], source_se)
+
+    def get(self, language):
+        """The loaded model for ``language``, loading it (and unloading others) if needed"""
+        language = language.upper()
+        if language not in self._load_locks:
+            raise ValueError(f"Unsupported language '{language}'. Supported languages: {', '.join(self.languages)}")
+        with self._lock:
+            model = self._models.get(language)
+            if model is not None:
+                self._models.move_to_end(language)
+                model.last_used = time.monotonic()
+                return model
+        # One load per language at a time, without blocking lookups of other languages
+        with self._load_locks[language]:
+            with self._lock:
+                model = self._models.get(language)
+            if model is None:
+                model = self._load(language)
+                with self._lock:
+                    self._models[language] = model
+                    self.stats["loads"] += 1
+                    self._evict(keep=language)
+            return model
+
+    @contextlib.contextmanager
+    def use(self, language):
+        """get(language), counted as in use (so not unloaded) until the block exits"""
+        model = self.get(language)
+        with self._lock:
+            model.users += 1
+        try:
+            yield model
+        finally:
+            with self._lock:
+                model.users -= 1
+                model.last_used = time.monotonic()
+
+    def _evict(self, keep):
+        # Caller holds self._lock; oldest first
+        if not self.memory_budget:
+            return
+        evicted = False
+        for language in list(self._models):
+            if self.loaded_bytes() <= self.memory_budget:
+                break
+            model = self._models[language]
+            if language == keep or language in self.pinned or model.users:
+                continue
+            del self._models[language]
+            # Languages sharing a BERT module (e.g. ZH and ZH_MIX_EN) keep it while one is loaded
+            if all(BERT_MODULES.get(other) != BERT_MODULES.get(language) for other in self._models):
+                release_bert(language)
+            self.stats["evictions"] += 1
+            evicted = True
+            print(f"Unloaded {language} base TTS, idle for {time.monotonic() - model.last_used:.0f} seconds")
+        if evicted:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def loaded_bytes(self):
+        total = sum(model.synth_bytes for model in self._models.values())
+        berts = {id(bert): bert for language in self._models for bert in bert_models(language)}
+        return total + sum(_module_bytes(bert) for bert in berts.values())
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models.values())
+
+    def info(self):
+        with self._lock:
+            return dict(
+                self.stats,
+                languages=self.languages,
+                loaded=list(self._models),
+                loaded_bytes=self.loaded_bytes(),
+                memory_budget=self.memory_budget
+            )